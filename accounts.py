@@ -0,0 +1,44 @@
+import os
+import threading
+from passwords import password_stamp
+
+# The account that can see and change everyone's data
+MASTER_NAME = os.environ.get('MASTER_NAME', 'Ethan Ryoo')
+
+
+class Account:
+    __slots__ = ('name', 'pw_stamp', 'is_master')
+
+    def __init__(self, name: str, pw_stamp: str, is_master: bool):
+        self.name = name
+        self.pw_stamp = pw_stamp
+        self.is_master = is_master
+
+
+class AccountRegistry:
+    # What checking a session needs to know about each user, kept per worker
+    # so that it is a dict lookup rather than a walk over the stored users.
+    # It is rebuilt when the storage engine reports a new version, which
+    # covers users added, passwords changed and data restored by any worker.
+    def __init__(self, storage):
+        self.storage = storage
+        self._accounts = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Account | None:
+        # As in Storage.load(), the version is taken before reading
+        version = self.storage.version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._accounts = {
+                        user: Account(user, password_stamp(record['password']), user == MASTER_NAME)
+                        for user, record in self.storage.users().items()
+                    }
+                    self._version = version
+        return self._accounts.get(name)
+
+    def is_master(self, name: str) -> bool:
+        account = self.get(name)
+        return account is not None and account.is_master
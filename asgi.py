@@ -0,0 +1,103 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from main import app as wsgi_app
+
+# Serves the Flask app over ASGI: uvicorn asgi:app
+# The event loop reads requests and writes responses, so slow clients only
+# cost a connection, while the views run unchanged on a pool of threads.
+# Each thread keeps its own copy of the storage engine's cached data (see
+# Storage), so the views can run side by side. bcrypt runs on its own pool
+# (see passwords.py).
+ASYNC_THREADS = int(os.environ.get('ASYNC_THREADS', 8))
+# Request bodies larger than this are spooled to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+_executor = ThreadPoolExecutor(ASYNC_THREADS, thread_name_prefix='view')
+
+
+def wsgi_environ(scope: dict, body) -> dict:
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI carries paths as latin-1 decoded bytes
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope['http_version']}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+def run_wsgi(environ: dict, send) -> None:
+    # Runs on one view thread from start to finish: a streamed body such as
+    # an export reads the cached data of the thread that began it. Each
+    # chunk is sent before the next is made, so a slow client holds back
+    # the stream rather than letting it pile up in memory.
+    response = {}
+    def start_response(status: str, headers: list, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+    result = wsgi_app(environ, start_response)
+    try:
+        send({'type': 'http.response.start', **response})
+        for chunk in result:
+            if chunk:
+                send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Off the loop, which views still running need in order to send
+            await asyncio.to_thread(_executor.shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope: dict, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError(f'Unsupported ASGI scope: {scope['type']}')
+    loop = asyncio.get_running_loop()
+    def send_from_thread(message: dict) -> None:
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+    with SpooledTemporaryFile(max_size=SPOOL_SIZE) as body:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        await loop.run_in_executor(
+            _executor, run_wsgi, wsgi_environ(scope, body), send_from_thread)
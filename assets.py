@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static files are read once at startup and served from memory under
+# fingerprinted names, already compressed, so browsers can keep them for
+# good. Stylesheets are minified and bundled per page, and the nav icons
+# share one SVG sprite. Every worker builds the same names from the same
+# files at startup, so any worker can serve a URL that another handed out.
+ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+# Responses smaller than this aren't worth a compressed copy
+MIN_COMPRESS_SIZE = 256
+MIMETYPES = {
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+    '.svg': 'image/svg+xml'
+}
+# Icons that are drawn from the sprite rather than linked on their own
+SPRITE_DIR = 'icons'
+SPRITE_EXCLUDE = {'tally.svg'}
+
+
+class Asset:
+    __slots__ = ('body', 'mimetype', 'digest', 'encoded')
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.body = body
+        self.mimetype = mimetype
+        self.digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.encoded = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            for encoding in ENCODINGS:
+                encoded = compress(body, encoding)
+                if len(encoded) < len(body):
+                    self.encoded[encoding] = encoded
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=11)
+    # mtime=0 keeps the output the same from one start to the next
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+def minify_css(css: str) -> str:
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r' ?([{};,>]) ?', r'\1', css)
+    # Only after colons: a space before one is a descendant selector
+    css = re.sub(r': ', ':', css)
+    return css.replace(';}', '}').strip()
+
+def svg_sprite(icons: dict[str, str]) -> tuple[str, dict[str, str]]:
+    # One <symbol> per icon, plus the viewBox each needs where it is drawn.
+    # Comments are kept once each, for the icons' licence notices.
+    comments = []
+    symbols = []
+    view_boxes = {}
+    for name, svg in icons.items():
+        for comment in re.findall(r'<!--.*?-->', svg, flags=re.S):
+            if comment not in comments:
+                comments.append(comment)
+        view_boxes[name] = re.search(r'viewBox="([^"]*)"', svg).group(1)
+        inner = re.sub(r'<!--.*?-->', '', svg, flags=re.S)
+        inner = re.sub(r'^\s*<svg[^>]*>|</svg>\s*$', '', inner).strip()
+        symbols.append(f'<symbol id="{name}" viewBox="{view_boxes[name]}">{inner}</symbol>')
+    sprite = (
+        '<svg xmlns="http://www.w3.org/2000/svg">'
+        + ''.join(comments) + ''.join(symbols) + '</svg>'
+    )
+    return sprite, view_boxes
+
+
+class AssetPipeline:
+    def __init__(self, folder: str):
+        self.sources = {}
+        for root, _, files in os.walk(folder):
+            for file in files:
+                path = os.path.join(root, file)
+                with open(path, 'rb') as f:
+                    self.sources[os.path.relpath(path, folder).replace(os.sep, '/')] = f.read()
+        # Covers every file, so it changes whenever any asset does
+        self.version = hashlib.blake2b(
+            repr(sorted(self.sources.items())).encode(), digest_size=8).hexdigest()
+        # Fingerprinted name -> Asset, and name as linked -> URL
+        self.assets = {}
+        self.manifest = {}
+        self._lock = threading.Lock()
+
+        sprited = [
+            path for path in sorted(self.sources)
+            if os.path.dirname(path) == SPRITE_DIR and path.endswith('.svg')
+            and os.path.basename(path) not in SPRITE_EXCLUDE
+        ]
+        sprite, self.view_boxes = svg_sprite({
+            os.path.splitext(os.path.basename(path))[0]: self.sources[path].decode()
+            for path in sprited
+        })
+        self.add(f'{SPRITE_DIR}/sprite.svg', sprite.encode())
+        for path, body in self.sources.items():
+            if os.path.splitext(path)[1] in ('.js', '.svg') and path not in sprited:
+                self.add(path, body)
+
+    def add(self, name: str, body: bytes) -> str:
+        stem, ext = os.path.splitext(name)
+        asset = Asset(body, MIMETYPES[ext])
+        with self._lock:
+            self.assets[f'{stem}.{asset.digest}{ext}'] = asset
+            self.manifest[name] = f'/assets/{stem}.{asset.digest}{ext}'
+        return self.manifest[name]
+
+    def url(self, name: str) -> str:
+        return self.manifest[name]
+
+    def bundle(self, styles: list[str]) -> str:
+        # Minified stylesheets, in order, as one file. Only called while the
+        # app starts; requests never add assets.
+        name = f'styles/{'+'.join(styles)}.css'
+        if name not in self.manifest:
+            css = '\n'.join(self.sources[f'styles/{style}.css'].decode() for style in styles)
+            self.add(name, minify_css(css).encode())
+        return self.manifest[name]
+
+    def get(self, served: str) -> Asset | None:
+        return self.assets.get(served)
@@ -0,0 +1,261 @@
+import codecs
+import csv
+import io
+import json
+from ledger import Ledger, Transaction, TxnType, date_key, new_txn_id, parse_cents
+
+# Backups are read a chunk at a time and each transaction is checked and
+# converted as soon as it has been parsed, so the raw upload is never held in
+# memory. Nothing is returned unless the whole file is valid.
+CHUNK_SIZE = 64 * 1024
+# No single user name, field or transaction may be larger than this
+MAX_VALUE_SIZE = 1024 * 1024
+TXN_FIELDS = {'type', 'date', 'amount', 'desc'}
+TXN_FIELDS_WITH_ID = TXN_FIELDS | {'id'}
+# Columns of CSV and JSON-lines imports and exports
+ROW_FIELDS = ['user', 'type', 'date', 'amount', 'desc', 'id']
+IMPORT_FORMATS = ['csv', 'jsonl']
+
+
+class InvalidBackup(ValueError):
+    pass
+
+
+class JsonStream:
+    # Just enough of an incremental JSON reader to walk objects and arrays
+    # member by member, decoding each leaf value with the json module
+    def __init__(self, f):
+        self.f = f
+        self.text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.consumed = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(CHUNK_SIZE)
+        self.eof = not chunk
+        try:
+            text = self.text_decoder.decode(chunk, final=self.eof)
+        except UnicodeDecodeError:
+            raise InvalidBackup('The backup is not valid UTF-8')
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return not self.eof or bool(text)
+
+    def error(self, message: str) -> InvalidBackup:
+        return InvalidBackup(f'{message} at character {self.consumed + self.pos}')
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self.error(f'Expected {char!r}')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value runs past the end of the buffer
+                if len(self.buffer) - self.pos > MAX_VALUE_SIZE or not self._fill():
+                    raise self.error('Invalid JSON')
+                continue
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        # Yields each key of an object; the caller reads the value
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise self.error('Expected a key')
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def elements(self):
+        # Yields the index of each element of an array; the caller reads it
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+
+def parse_transaction(txn, where: str) -> Transaction:
+    if not isinstance(txn, dict):
+        raise InvalidBackup(f'{where}: expected an object')
+    if txn.keys() != TXN_FIELDS and txn.keys() != TXN_FIELDS_WITH_ID:
+        missing = sorted(TXN_FIELDS - txn.keys())
+        unknown = sorted(txn.keys() - TXN_FIELDS_WITH_ID)
+        raise InvalidBackup(f'{where}: missing {missing}, unknown {unknown}')
+    try:
+        txn_type = TxnType(txn['type'])
+        day = date_key(txn['date'])
+        cents = parse_cents(txn['amount'])
+    except (TypeError, ValueError) as e:
+        raise InvalidBackup(f'{where}: {e}')
+    if cents < 0:
+        raise InvalidBackup(f'{where}: negative amount')
+    if not isinstance(txn['desc'], str):
+        raise InvalidBackup(f'{where}: the description must be a string')
+    txn_id = txn['id'] if 'id' in txn else new_txn_id()
+    if not isinstance(txn_id, str) or not txn_id:
+        raise InvalidBackup(f'{where}: invalid id')
+    return Transaction(txn_type, day, cents, txn['desc'], txn_id)
+
+def read_ledger(stream: JsonStream, name: str, ids: set) -> Ledger:
+    txns = []
+    for i in stream.elements():
+        txn = parse_transaction(stream.value(), f'{name}: transaction {i}')
+        if txn.id in ids:
+            raise InvalidBackup(f'{name}: transaction {i}: duplicate id {txn.id}')
+        ids.add(txn.id)
+        txns.append(txn)
+    # Backups are written newest first, which Ledger sorts in linear time
+    return Ledger(txns)
+
+def read_user(stream: JsonStream, name: str, ids: set) -> dict:
+    user = {}
+    for field in stream.members():
+        if field in user:
+            raise InvalidBackup(f'{name}: duplicate field {field!r}')
+        if field == 'transactions':
+            user[field] = read_ledger(stream, name, ids)
+        elif field in ('password', 'dark_mode'):
+            user[field] = stream.value()
+        else:
+            raise InvalidBackup(f'{name}: unknown field {field!r}')
+    if user.keys() != {'password', 'dark_mode', 'transactions'}:
+        raise InvalidBackup(f'{name}: missing fields')
+    password = user['password']
+    if password is not None and not (isinstance(password, str) and password.startswith('$2')):
+        raise InvalidBackup(f'{name}: the password must be a bcrypt hash or null')
+    if not isinstance(user['dark_mode'], bool):
+        raise InvalidBackup(f'{name}: dark_mode must be true or false')
+    return {
+        'password': password,
+        'dark_mode': user['dark_mode'],
+        'transactions': user['transactions']
+    }
+
+def read_backup(f) -> dict:
+    # f is a binary file containing a data.json backup
+    stream = JsonStream(f)
+    data = {}
+    ids = set()
+    for name in stream.members():
+        if not name.strip():
+            raise InvalidBackup('Empty user name')
+        if name in data:
+            raise InvalidBackup(f'Duplicate user {name!r}')
+        data[name] = read_user(stream, name, ids)
+    if stream.peek():
+        raise stream.error('Unexpected data after the backup')
+    return data
+
+def read_rows(f, fmt: str):
+    # Yields (line number, row) for each transaction in a CSV or JSON-lines file
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise InvalidBackup(f'line {line_num}: {e}')
+    except UnicodeDecodeError:
+        raise InvalidBackup('The file is not valid UTF-8')
+    finally:
+        # Leaves the upload itself open for the caller
+        text.detach()
+
+def read_import(f, fmt: str, data: dict) -> dict[str, list[dict]]:
+    # Transactions for existing users, grouped by user in file order and
+    # ready for an import_txns op. As on the master page, a blank
+    # description defaults to the transaction type.
+    batch = {}
+    # Ids already stored and ids earlier in the file are both taken
+    ids = {txn.id for user in data.values() for txn in user['transactions']}
+    for line_num, row in read_rows(f, fmt):
+        where = f'line {line_num}'
+        if not isinstance(row, dict):
+            raise InvalidBackup(f'{where}: expected an object')
+        # csv.DictReader puts the fields beyond the header under None
+        if None in row:
+            raise InvalidBackup(f'{where}: too many fields')
+        name = row.pop('user', None)
+        if name not in data:
+            raise InvalidBackup(f'{where}: unknown user {name!r}')
+        if not row.get('desc'):
+            row['desc'] = str(row.get('type')).capitalize()
+        if not row.get('id'):
+            row.pop('id', None)
+        txn = parse_transaction(row, where)
+        if txn.id in ids:
+            raise InvalidBackup(f'{where}: duplicate id {txn.id}')
+        ids.add(txn.id)
+        batch.setdefault(name, []).append(txn.to_json())
+    return batch
+
+def export_rows(users: dict[str, list[Transaction]]):
+    # Oldest first, so that importing the rows again keeps same-day order
+    for name, txns in users.items():
+        for txn in reversed(txns):
+            yield {'user': name, **txn.to_json()}
+
+def csv_chunks(users: dict[str, list[Transaction]], batch: int = 1000):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, ROW_FIELDS)
+    writer.writeheader()
+    for i, row in enumerate(export_rows(users), 1):
+        writer.writerow(row)
+        if i % batch == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+def jsonl_chunks(users: dict[str, list[Transaction]], batch: int = 1000):
+    lines = []
+    for row in export_rows(users):
+        lines.append(json.dumps(row) + '\n')
+        if len(lines) == batch:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
@@ -0,0 +1,125 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+from bench_routes import (
+    ROOT, free_port, http_session, percentile, seed, user_name, wait_until_up
+)
+
+# Compares sync gunicorn workers with the ASGI mode (uvicorn asgi:app in one
+# process) while slow clients hold connections open. Each slow client sends
+# its request headers a line at a time over SLOW_SECONDS, as a client on a
+# poor connection would; meanwhile signed-in clients fetch /home as fast as
+# they can. A sync worker is tied up for as long as it takes to read a slow
+# request, whereas the event loop only hands complete requests to a thread.
+# Usage: python benchmarks/bench_async.py
+
+SERVERS = {
+    'gunicorn': lambda port: [
+        sys.executable, '-m', 'gunicorn', '--workers', '2',
+        '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app'
+    ],
+    'asgi': lambda port: [
+        sys.executable, '-m', 'uvicorn', '--port', str(port),
+        '--log-level', 'warning', 'asgi:app'
+    ],
+}
+SLOW_CLIENTS = [0, 50]
+SLOW_SECONDS = 3
+SLOW_INTERVAL = 0.25
+FAST_CLIENTS = 4
+DURATION = 5
+REQUEST_TIMEOUT = 10
+USERS, TRANSACTIONS = 10, 1000
+
+def slow_client(port: int, completed: list) -> None:
+    try:
+        with socket.create_connection(
+            ('127.0.0.1', port), timeout=SLOW_SECONDS + REQUEST_TIMEOUT
+        ) as conn:
+            conn.sendall(b'GET /login HTTP/1.1\r\nHost: localhost\r\n')
+            deadline = time.monotonic() + SLOW_SECONDS
+            i = 0
+            while time.monotonic() < deadline:
+                conn.sendall(f'X-Slow-{i}: 1\r\n'.encode())
+                i += 1
+                time.sleep(SLOW_INTERVAL)
+            conn.sendall(b'Connection: close\r\n\r\n')
+            response = b''
+            while chunk := conn.recv(65536):
+                response += chunk
+        completed.append(response.startswith(b'HTTP/1.1 200'))
+    except OSError:
+        completed.append(False)
+
+def fast_client(send, deadline: float, latencies: list, timeouts: list) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            send('GET', '/home', None)
+        except (urllib.error.URLError, TimeoutError, ConnectionError):
+            timeouts.append(1)
+        latencies.append(time.perf_counter() - start)
+
+def run(server: str, slow_clients: int) -> dict:
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'data.json')
+        seed('json', data_file, USERS, TRANSACTIONS)
+        process = subprocess.Popen(
+            SERVERS[server](port), cwd=ROOT,
+            env={**os.environ, 'STORAGE_ENGINE': 'json', 'DATA_FILE': data_file}
+        )
+        try:
+            wait_until_up(base_url)
+            sessions = [
+                http_session(base_url, user_name(i % USERS), timeout=REQUEST_TIMEOUT)
+                for i in range(FAST_CLIENTS)
+            ]
+            completed = []
+            slow = [
+                threading.Thread(target=slow_client, args=(port, completed))
+                for _ in range(slow_clients)
+            ]
+            for thread in slow:
+                thread.start()
+            # Lets the slow clients connect first
+            time.sleep(0.5)
+            latencies, timeouts = [], []
+            deadline = time.perf_counter() + DURATION
+            fast = [
+                threading.Thread(target=fast_client, args=(send, deadline, latencies, timeouts))
+                for send in sessions
+            ]
+            for thread in fast:
+                thread.start()
+            for thread in fast + slow:
+                thread.join()
+        finally:
+            process.terminate()
+            process.wait()
+    return {
+        'throughput': (len(latencies) - len(timeouts)) / DURATION,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'timeouts': len(timeouts),
+        'slow_ok': sum(completed)
+    }
+
+def main() -> None:
+    print(f'{"server":<9} {"slow":>5} {"req/s":>8} {"p50":>9} {"p99":>9} '
+          f'{"timeouts":>9} {"slow ok":>8}')
+    for slow_clients in SLOW_CLIENTS:
+        for server in SERVERS:
+            result = run(server, slow_clients)
+            print(f'{server:<9} {slow_clients:>5} {result["throughput"]:>8.1f} '
+                  f'{result["p50"] * 1e3:>7.1f}ms {result["p99"] * 1e3:>7.1f}ms '
+                  f'{result["timeouts"]:>9} {result["slow_ok"]:>5}/{slow_clients}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime as dt, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ['DATA_FILE'] = os.path.join(tempfile.mkdtemp(), 'data.json')
+import main
+from ledger import Ledger, Transaction
+
+# Compares transaction insertion and row date formatting before and after
+# ledgers kept pre-parsed date keys. Usage: python benchmarks/bench_ledger.py
+
+SIZES = [10_000, 100_000]
+INSERTS = 50
+
+def linear_insert(transactions: list[dict], new_txn: dict) -> None:
+    # The original insert_transaction
+    new_txn_date = dt.strptime(new_txn['date'], '%Y-%m-%d')
+    for i, txn in enumerate(transactions):
+        if new_txn_date >= dt.strptime(txn['date'], '%Y-%m-%d'):
+            transactions.insert(i, new_txn)
+            return
+    transactions.append(new_txn)
+
+def random_txn(rng: random.Random, days: int) -> dict:
+    return {
+        'type': rng.choice(['debt', 'repayment']),
+        'date': str(date(2000, 1, 1) + timedelta(days=rng.randrange(days))),
+        'amount': f'{rng.uniform(1, 100):.2f}',
+        'desc': 'Benchmark'
+    }
+
+def make_ledger(size: int, rng: random.Random) -> list[dict]:
+    return sorted(
+        (random_txn(rng, size // 2) for _ in range(size)),
+        key=lambda txn: txn['date'], reverse=True
+    )
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main_() -> None:
+    print(f'{"transactions":>12} {"operation":<22} {"before":>12} {"after":>12} {"speedup":>9}')
+    for size in SIZES:
+        rng = random.Random(size)
+        txns = make_ledger(size, rng)
+        new_txns = [random_txn(rng, size // 2) for _ in range(INSERTS)]
+
+        plain = list(txns)
+        before = timed(lambda: [linear_insert(plain, txn) for txn in new_txns]) / INSERTS
+        ledger = Ledger.from_json(txns)
+        records = [Transaction.from_json(txn) for txn in new_txns]
+        after = timed(lambda: [ledger.insert(txn) for txn in records]) / INSERTS
+        print(f'{size:>12} {"insert (per txn)":<22} {before * 1e3:>10.3f}ms '
+              f'{after * 1e3:>10.3f}ms {before / after:>8.1f}x')
+
+        def format_uncached():
+            # As rows were rendered before main.format_date
+            for txn in txns:
+                dt.strptime(txn['date'], '%Y-%m-%d').strftime('%a %d/%m/%y')
+        days = [Transaction.from_json(txn).day for txn in txns]
+        def format_cached():
+            for day in days:
+                main.format_date(day)
+        before = timed(format_uncached)
+        # The first render after a start, then one with the cache filled
+        main.format_date.cache_clear()
+        cold = timed(format_cached)
+        warm = timed(format_cached)
+        for label, after in [('format dates (cold)', cold), ('format dates (warm)', warm)]:
+            print(f'{size:>12} {label:<22} {before * 1e3:>10.3f}ms '
+                  f'{after * 1e3:>10.3f}ms {before / after:>8.1f}x')
+
+if __name__ == '__main__':
+    main_()
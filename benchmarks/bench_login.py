@@ -0,0 +1,132 @@
+import http.client
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from bench_routes import ROOT, free_port, http_session, percentile, wait_until_up
+
+# Measures page latency under gunicorn while sign-ins run alongside. "sync"
+# is a plain sync worker, where a sign-in holds the worker for the whole
+# hash; "procfile" is the deployed command, whose threads keep serving pages
+# while at most PASSWORD_THREADS + PASSWORD_QUEUE sign-ins wait on bcrypt.
+# Both run one worker process, so the difference is down to threads.
+# Usage: python benchmarks/bench_login.py
+
+def procfile_command() -> list[str]:
+    with open(os.path.join(ROOT, 'Procfile')) as f:
+        command = shlex.split(f.read().split('web:', 1)[1])
+    return [sys.executable, '-m', *command]
+
+SERVERS = {
+    'sync': [sys.executable, '-m', 'gunicorn', 'main:app'],
+    'procfile': procfile_command(),
+}
+LOGIN_CLIENTS = 8
+BROWSE_CLIENTS = 4
+DURATION = 10
+TRANSACTIONS = 500
+REQUEST_TIMEOUT = 30
+
+def seed(data_file: str) -> None:
+    from passwords import hash_password
+    from storage import get_storage
+    get_storage('json', data_file).save({
+        'Ethan Ryoo': {'password': None, 'dark_mode': False, 'transactions': []},
+        'Bench User': {'password': hash_password('pw'), 'dark_mode': False, 'transactions': []},
+        **{
+            f'Browser {i}': {
+                'password': None,
+                'dark_mode': False,
+                'transactions': [
+                    {'type': 'debt', 'date': f'2024-{j % 12 + 1:02d}-01',
+                     'amount': '1.50', 'desc': f'Benchmark {j}'}
+                    for j in range(TRANSACTIONS)
+                ]
+            }
+            for i in range(BROWSE_CLIENTS)
+        }
+    })
+
+def sign_in(port: int) -> int:
+    # The status of the sign-in itself, without following its redirect
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+    try:
+        conn.request(
+            'POST', '/', urllib.parse.urlencode({'name': 'Bench User', 'password': 'pw'}),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+def run(server: str) -> dict:
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'data.json')
+        seed(data_file)
+        process = subprocess.Popen(
+            [*SERVERS[server], '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            cwd=ROOT, env={**os.environ, 'STORAGE_ENGINE': 'json', 'DATA_FILE': data_file}
+        )
+        try:
+            wait_until_up(base_url)
+            sessions = [
+                http_session(base_url, f'Browser {i}', timeout=REQUEST_TIMEOUT)
+                for i in range(BROWSE_CLIENTS)
+            ]
+            stop = threading.Event()
+            logins, rejected, pages = [], [], []
+
+            def login_loop():
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    status = sign_in(port)
+                    elapsed = time.perf_counter() - start
+                    if status == 503:
+                        rejected.append(elapsed)
+                        # As the response's Retry-After asks
+                        time.sleep(1)
+                    else:
+                        logins.append(elapsed)
+
+            def browse_loop(send):
+                while not stop.is_set():
+                    for page in ['/home', '/history']:
+                        start = time.perf_counter()
+                        send('GET', page, None)
+                        pages.append(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=browse_loop, args=(send,)) for send in sessions]
+            threads += [threading.Thread(target=login_loop) for _ in range(LOGIN_CLIENTS)]
+            for thread in threads:
+                thread.start()
+            time.sleep(DURATION)
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            process.terminate()
+            process.wait()
+    return {'logins': logins, 'rejected': len(rejected), 'pages': pages}
+
+def main() -> None:
+    print(f'{"server":<10} {"pages/s":>8} {"page p50":>9} {"page p95":>9} '
+          f'{"page p99":>9} {"logins/s":>9} {"login p50":>10} {"login p95":>10} '
+          f'{"rejected":>9}')
+    for name in SERVERS:
+        result = run(name)
+        pages, logins = result['pages'], result['logins']
+        print(f'{name:<10} {len(pages) / DURATION:>8.1f} '
+              f'{percentile(pages, 50) * 1e3:>7.1f}ms {percentile(pages, 95) * 1e3:>7.1f}ms '
+              f'{percentile(pages, 99) * 1e3:>7.1f}ms {len(logins) / DURATION:>9.1f} '
+              f'{percentile(logins, 50) * 1e3:>8.1f}ms {percentile(logins, 95) * 1e3:>8.1f}ms '
+              f'{result["rejected"]:>9}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ['DATA_FILE'] = os.path.join(tempfile.mkdtemp(), 'data.json')
+import pyhtml as p
+import main
+from ledger import Ledger, Transaction, TxnType
+
+# Compares rendering a page of transaction rows as pyhtml tags with the
+# TxnRows renderer. Usage: python benchmarks/bench_render.py
+
+PAGES = 200
+
+def tag_rows(txns: Ledger, start: int, interactive: bool, user: str) -> list:
+    # The rows as txn_rows_maker built them before TxnRows
+    rows = []
+    for i in range(start, min(start + main.HISTORY_PAGE_SIZE, len(txns))):
+        entry = txns[i]
+        date_str, amount_str, balance_str = main.txn_row_strings(txns, i)
+        css_class = f'grid_container {entry.type}'
+        content = [
+            p.p(_class='date')(date_str),
+            p.p(_class='amount')(amount_str),
+            p.p(_class='desc')(entry.desc),
+            p.p(_class='total')(
+                p.span(_class='total_owing_desc')('Total owing: '),
+                balance_str
+            )
+        ]
+        if interactive:
+            rows.append(p.button(
+                _class=css_class, formaction=f'/edit/{user}/transaction/{entry.id}',
+                **{'data-desc': entry.desc})(content))
+        else:
+            rows.append(p.div(_class=css_class, **{'data-desc': entry.desc})(content))
+    return rows
+
+def measure(render) -> tuple[float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(PAGES):
+        render()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / PAGES, peak
+
+def main_() -> None:
+    rng = random.Random(0)
+    txns = Ledger([
+        Transaction(
+            rng.choice(list(TxnType)), 738000 + rng.randrange(1000),
+            rng.randrange(10000), f'Benchmark transaction {i}', f'{i:016x}'
+        )
+        for i in range(1000)
+    ])
+    print(f'{"rows":<12} {"before":>10} {"after":>10} {"speedup":>8} '
+          f'{"peak before":>12} {"peak after":>11}')
+    for interactive in [False, True]:
+        before = measure(lambda: str(p.div(p.form(tag_rows(txns, 0, interactive, 'Bench')))))
+        after = measure(
+            lambda: str(p.div(p.form(main.TxnRows(txns, 0, interactive, 'Bench')))))
+        label = 'edit page' if interactive else 'history page'
+        print(f'{label:<12} {before[0] * 1e3:>8.2f}ms {after[0] * 1e3:>8.2f}ms '
+              f'{before[0] / after[0]:>7.1f}x {before[1] / 1024:>10.0f}KB '
+              f'{after[1] / 1024:>9.0f}KB')
+
+if __name__ == '__main__':
+    main_()
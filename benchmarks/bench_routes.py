@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime as dt, timedelta
+from http.cookiejar import CookieJar
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from storage import DATA_FILES
+
+# Drives the main routes against synthetic data at several scales (users x
+# transactions per user), through the Flask test client and a local gunicorn,
+# and reports throughput, p50/p99 latency and peak RSS. Each run is a child
+# process of its own, so RSS and module state don't carry over between runs.
+# --save writes the results as a JSON baseline; --compare checks a new run
+# against one and exits with status 1 if anything regressed.
+# Usage: python benchmarks/bench_routes.py [--mode client] [--scales 10x1000]
+#        [--engine json] [--save baseline.json | --compare baseline.json]
+
+MASTER = 'Ethan Ryoo'
+SCENARIOS = ['home', 'history', 'edit', 'add', 'toggle']
+SCALES = ['10x100', '10x5000', '100x500']
+MODES = ['client', 'gunicorn']
+CLIENTS = 4
+DURATION = 2
+GUNICORN_WORKERS = 2
+# A scenario regresses when its throughput falls, or its p99 latency rises,
+# by more than this fraction of the baseline
+TOLERANCE = 0.2
+
+def parse_scale(scale: str) -> tuple[int, int]:
+    users, txns = scale.split('x')
+    return int(users), int(txns)
+
+def user_name(i: int) -> str:
+    return f'User {i:04d}'
+
+def generate_data(users: int, txns: int, seed: int = 0) -> dict:
+    # The same scale always gives the same data
+    rng = random.Random(seed)
+    data = {MASTER: {'password': None, 'dark_mode': False, 'transactions': []}}
+    for i in range(users):
+        days = sorted((rng.randrange(3650) for _ in range(txns)), reverse=True)
+        data[user_name(i)] = {
+            'password': None,
+            'dark_mode': False,
+            'transactions': [
+                {
+                    'type': rng.choice(['debt', 'repayment']),
+                    'date': str(date(2015, 1, 1) + timedelta(days=day)),
+                    'amount': f'{rng.uniform(1, 100):.2f}',
+                    'desc': f'Benchmark transaction {j}'
+                }
+                for j, day in enumerate(days)
+            ]
+        }
+    return data
+
+def scenario_request(scenario: str, user: str) -> tuple[bool, str, str, dict | None]:
+    # (signed in as master, method, path, form)
+    if scenario == 'home':
+        return False, 'GET', '/home', None
+    if scenario == 'history':
+        return False, 'GET', '/history', None
+    if scenario == 'edit':
+        return True, 'GET', f'/edit/{urllib.parse.quote(user)}', None
+    if scenario == 'add':
+        return True, 'POST', '/master', {
+            'transaction_submit': 'Add', 'user': user, 'type': 'debt',
+            'date': '2025-01-01', 'amount': '1.00', 'desc': 'Benchmark'
+        }
+    if scenario == 'toggle':
+        return False, 'POST', '/toggle_dark_mode', None
+    raise ValueError(f'Unknown scenario: {scenario}')
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return float('nan')
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def test_client_session(app, name: str):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        # Benchmark users have no password
+        session['name'] = name
+        session['pw_stamp'] = ''
+    def send(method: str, path: str, form: dict | None) -> int:
+        return client.open(path, method=method, data=form).status_code
+    return send
+
+def http_session(base_url: str, name: str, timeout: float | None = None):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    def send(method: str, path: str, form: dict | None) -> int:
+        body = urllib.parse.urlencode(form).encode() if form is not None else None
+        if method == 'POST' and body is None:
+            body = b''
+        request = urllib.request.Request(base_url + path, data=body, method=method)
+        try:
+            with opener.open(request, timeout=timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    send('POST', '/', {'name': name, 'password': ''})
+    return send
+
+def drive(make_session, scenario: str, users: int, clients: int, duration: float) -> dict:
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client_loop(i: int):
+        as_master, method, path, form = scenario_request(scenario, user_name(i % users))
+        send = make_session(MASTER if as_master else user_name(i % users))
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status = send(method, path, form)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 50) * 1e3,
+        'p99_ms': percentile(latencies, 99) * 1e3
+    }
+
+def seed(engine: str, data_file: str, users: int, txns: int) -> None:
+    from storage import get_storage
+    get_storage(engine, data_file).save(generate_data(users, txns))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_until_up(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f'{base_url}/login') as response:
+                response.read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def child(args) -> None:
+    # One mode, engine and scale; prints the results as a line of JSON
+    os.chdir(ROOT)
+    users, txns = parse_scale(args.scales)
+    seed(args.engine, os.environ['DATA_FILE'], users, txns)
+    results = {}
+    if args.mode == 'client':
+        import main
+        for scenario in args.scenarios:
+            results[scenario] = drive(
+                lambda name: test_client_session(main.app, name),
+                scenario, users, args.clients, args.duration)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    else:
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers),
+             '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app'],
+            cwd=ROOT
+        )
+        try:
+            wait_until_up(base_url)
+            for scenario in args.scenarios:
+                results[scenario] = drive(
+                    lambda name: http_session(base_url, name),
+                    scenario, users, args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        # gunicorn reaps its workers, so this covers the largest of them
+        peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    for result in results.values():
+        # ru_maxrss is in kilobytes on Linux
+        result['peak_rss_mb'] = peak_rss / 1024
+    print(json.dumps(results))
+
+def run(args, mode: str, scale: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, DATA_FILES[args.engine])
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', '--mode', mode, '--scales', scale,
+             '--engine', args.engine, '--duration', str(args.duration),
+             '--clients', str(args.clients), '--workers', str(args.workers),
+             '--scenarios', ','.join(args.scenarios)],
+            check=True, capture_output=True, text=True,
+            env={**os.environ, 'STORAGE_ENGINE': args.engine, 'DATA_FILE': data_file}
+        ).stdout
+    return json.loads(output.splitlines()[-1])
+
+def result_key(result: dict) -> tuple:
+    return (result['mode'], result['engine'], result['scale'], result['scenario'])
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    # Describes each regression against the baseline
+    old = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        label = ' '.join(result_key(result))
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(
+                f'{label}: {before["throughput"]:.1f} -> {result["throughput"]:.1f} req/s')
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{label}: p99 {before["p99_ms"]:.1f} -> {result["p99_ms"]:.1f}ms')
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark Tally\'s routes')
+    parser.add_argument('--mode', choices=[*MODES, 'both'], default='both')
+    parser.add_argument('--engine', choices=list(DATA_FILES), default='json')
+    parser.add_argument('--scales', default=','.join(SCALES),
+                        help='comma separated users x transactions, e.g. 10x1000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=DURATION,
+                        help='seconds per scenario')
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--workers', type=int, default=GUNICORN_WORKERS)
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='check against a baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(',')
+    if args.child:
+        child(args)
+        return
+
+    modes = MODES if args.mode == 'both' else [args.mode]
+    results = []
+    print(f'{"mode":<9} {"engine":<8} {"scale":<9} {"scenario":<8} {"req/s":>8} '
+          f'{"p50":>9} {"p99":>9} {"peak RSS":>9} {"errors":>7}')
+    for mode in modes:
+        for scale in args.scales.split(','):
+            for scenario, result in run(args, mode, scale).items():
+                result = {
+                    'mode': mode, 'engine': args.engine, 'scale': scale,
+                    'scenario': scenario, **result
+                }
+                results.append(result)
+                print(f'{mode:<9} {args.engine:<8} {scale:<9} {scenario:<8} '
+                      f'{result["throughput"]:>8.1f} {result["p50_ms"]:>7.1f}ms '
+                      f'{result["p99_ms"]:>7.1f}ms {result["peak_rss_mb"]:>7.1f}MB '
+                      f'{result["errors"]:>7}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created': dt.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'clients': args.clients,
+                'duration': args.duration,
+                'results': results
+            }, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import heapq
+import secrets
+from bisect import bisect_left
+from datetime import date, datetime as dt
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from enum import StrEnum
+from functools import lru_cache
+from itertools import accumulate, islice
+
+def date_key(date_str: str) -> int:
+    try:
+        return date.fromisoformat(date_str).toordinal()
+    except ValueError:
+        return dt.strptime(date_str, '%Y-%m-%d').toordinal()
+
+def parse_cents(amount) -> int:
+    # Amounts are stored as the string typed into the form, e.g. '12.5'
+    try:
+        cents = (Decimal(str(amount)) * 100).quantize(Decimal(1), ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {amount!r}')
+    return int(cents)
+
+def format_cents(cents: int) -> str:
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+@lru_cache(maxsize=None)
+def month_key(day: int) -> int:
+    # Months since 1 AD, so that consecutive months are consecutive integers
+    month = date.fromordinal(day)
+    return month.year * 12 + month.month - 1
+
+def new_txn_id() -> str:
+    return secrets.token_hex(8)
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+class TxnType(StrEnum):
+    DEBT = 'debt'
+    REPAYMENT = 'repayment'
+
+
+class Transaction:
+    # Compact in-memory form of a transaction: dates as ordinals and amounts
+    # in whole cents, so that balances are exact integer sums. The id stays
+    # with the transaction for its whole life; data written before ids were
+    # introduced has None until assign_txn_ids() runs.
+    __slots__ = ('type', 'day', 'cents', 'desc', 'id')
+
+    def __init__(
+        self, type: TxnType, day: int, cents: int, desc: str, id: str | None = None
+    ):
+        self.type = type
+        self.day = day
+        self.cents = cents
+        self.desc = desc
+        self.id = id
+
+    @classmethod
+    def from_json(cls, txn: dict) -> 'Transaction':
+        return cls(
+            TxnType(txn['type']), date_key(txn['date']),
+            parse_cents(txn['amount']), txn['desc'], txn.get('id')
+        )
+
+    def to_json(self) -> dict:
+        txn = {
+            'type': self.type.value,
+            'date': self.date,
+            'amount': format_cents(self.cents),
+            'desc': self.desc
+        }
+        if self.id is not None:
+            txn['id'] = self.id
+        return txn
+
+    @property
+    def date(self) -> str:
+        return date.fromordinal(self.day).isoformat()
+
+    @property
+    def signed_cents(self) -> int:
+        return self.cents if self.type is TxnType.DEBT else -self.cents
+
+
+class Ledger:
+    # A user's transactions, newest first, together with the running total
+    # owing after each one. Totals are kept oldest first so that the usual
+    # case of adding or editing a recent transaction only touches the end.
+    # Negated date ordinals ascend alongside the transactions and so can be
+    # binary searched.
+    def __init__(self, txns: list[Transaction] = ()):
+        # A stable sort keeps same-day order and is linear for sorted input
+        self._txns = sorted(txns, key=lambda txn: -txn.day)
+        self._keys = [-txn.day for txn in self._txns]
+        self._by_id = {txn.id: txn for txn in self._txns if txn.id is not None}
+        self._totals = []
+        self._update_totals(0)
+        # Trigram -> transactions whose description contains it, built the
+        # first time the ledger is searched
+        self._grams = None
+        # Month (see month_key) -> [debt cents, repaid cents, transactions],
+        # built the first time the ledger's statistics are viewed
+        self._months = None
+        # Set by the storage engine whenever the user's data changes
+        self.version = None
+
+    @classmethod
+    def from_json(cls, txns: list[dict]) -> 'Ledger':
+        return cls([Transaction.from_json(txn) for txn in txns])
+
+    def __len__(self) -> int:
+        return len(self._txns)
+
+    def __iter__(self):
+        return iter(self._txns)
+
+    def __getitem__(self, index: int) -> Transaction:
+        return self._txns[index]
+
+    def __contains__(self, txn_id: str) -> bool:
+        return txn_id in self._by_id
+
+    def get(self, txn_id: str) -> Transaction:
+        return self._by_id[txn_id]
+
+    def _update_totals(self, start: int) -> None:
+        # Recomputes the running totals from the start-th oldest transaction
+        del self._totals[start:]
+        total = self._totals[-1] if self._totals else 0
+        self._totals.extend(accumulate(
+            (txn.signed_cents for txn in reversed(self._txns[:len(self._txns) - start])),
+            initial=total
+        ))
+        # accumulate() yields the starting total first
+        del self._totals[start]
+
+    def insert(self, new_txn: Transaction) -> int:
+        # Goes before any transactions on the same day
+        i = bisect_left(self._keys, -new_txn.day)
+        self._keys.insert(i, -new_txn.day)
+        self._txns.insert(i, new_txn)
+        if new_txn.id is not None:
+            self._by_id[new_txn.id] = new_txn
+        self._update_totals(len(self._txns) - i - 1)
+        self._index_add(new_txn)
+        self._rollup(new_txn, 1)
+        return i
+
+    def merge(self, new_txns: list[Transaction]) -> None:
+        # Same result as inserting each transaction in turn, in one pass:
+        # later transactions go first among those on the same day
+        if not new_txns:
+            return
+        batch = sorted(reversed(new_txns), key=lambda txn: -txn.day)
+        oldest = len(self._txns) - bisect_left(self._keys, -batch[-1].day)
+        self._txns = list(heapq.merge(batch, self._txns, key=lambda txn: -txn.day))
+        self._keys = [-txn.day for txn in self._txns]
+        for txn in batch:
+            if txn.id is not None:
+                self._by_id[txn.id] = txn
+            self._index_add(txn)
+            self._rollup(txn, 1)
+        # Everything older than the oldest new transaction keeps its total
+        self._update_totals(oldest)
+
+    def pop(self, index: int) -> Transaction:
+        if index < 0:
+            index += len(self._txns)
+        txn = self._txns.pop(index)
+        del self._keys[index]
+        self._by_id.pop(txn.id, None)
+        self._update_totals(len(self._txns) - index)
+        self._index_remove(txn)
+        self._rollup(txn, -1)
+        return txn
+
+    def replace(self, index: int, new_txn: Transaction) -> int:
+        # Keeps the transaction's place unless its date changed
+        if new_txn.day == self._txns[index].day:
+            if index < 0:
+                index += len(self._txns)
+            self._index_remove(self._txns[index])
+            self._rollup(self._txns[index], -1)
+            self._by_id.pop(self._txns[index].id, None)
+            self._txns[index] = new_txn
+            if new_txn.id is not None:
+                self._by_id[new_txn.id] = new_txn
+            self._update_totals(len(self._txns) - index - 1)
+            self._index_add(new_txn)
+            self._rollup(new_txn, 1)
+            return index
+        self.pop(index)
+        return self.insert(new_txn)
+
+    @property
+    def balance(self) -> int:
+        # Total owing, in cents
+        return self._totals[-1] if self._totals else 0
+
+    def running_total(self, index: int) -> int:
+        # Total owing, in cents, once the index-th newest transaction is included
+        if index < 0:
+            index += len(self._txns)
+        return self._totals[len(self._txns) - index - 1]
+
+    def assign_ids(self) -> bool:
+        # Gives an id to every transaction that lacks one
+        assigned = False
+        for txn in self._txns:
+            if txn.id is None:
+                txn.id = new_txn_id()
+                self._by_id[txn.id] = txn
+                assigned = True
+        return assigned
+
+    def index_of(self, txn: Transaction) -> int:
+        i = bisect_left(self._keys, -txn.day)
+        while self._txns[i] is not txn:
+            i += 1
+        return i
+
+    def _index_add(self, txn: Transaction) -> None:
+        if self._grams is None:
+            return
+        for gram in trigrams(txn.desc.lower()):
+            self._grams.setdefault(gram, set()).add(txn)
+
+    def _index_remove(self, txn: Transaction) -> None:
+        if self._grams is None:
+            return
+        for gram in trigrams(txn.desc.lower()):
+            self._grams[gram].discard(txn)
+
+    def _rollup(self, txn: Transaction, sign: int) -> None:
+        if self._months is None:
+            return
+        key = month_key(txn.day)
+        month = self._months.setdefault(key, [0, 0, 0])
+        month[0 if txn.type is TxnType.DEBT else 1] += sign * txn.cents
+        month[2] += sign
+        if not month[2]:
+            del self._months[key]
+
+    def monthly_totals(self) -> dict[int, list[int]]:
+        if self._months is None:
+            self._months = {}
+            for txn in self._txns:
+                self._rollup(txn, 1)
+        return self._months
+
+    def search(self, query: str) -> list[int]:
+        # Indexes of the transactions whose description contains the query,
+        # ignoring case, newest first
+        query = query.lower()
+        if len(query) < 3:
+            return [i for i, txn in enumerate(self._txns) if query in txn.desc.lower()]
+        if self._grams is None:
+            self._grams = {}
+            for txn in self._txns:
+                self._index_add(txn)
+        candidates = set.intersection(
+            *(self._grams.get(gram, set()) for gram in trigrams(query)))
+        return sorted(
+            self.index_of(txn) for txn in candidates if query in txn.desc.lower())
+
+    def to_json(self) -> list[dict]:
+        return [txn.to_json() for txn in self._txns]
+
+
+def monthly_rollup(ledgers) -> list[tuple[int, int, int, int]]:
+    # (month, debt cents, repaid cents, balance at the end of the month)
+    # across the given ledgers, oldest first. Only months with transactions
+    # are included.
+    totals = {}
+    for ledger in ledgers:
+        for month, (debt, repaid, _) in ledger.monthly_totals().items():
+            total = totals.setdefault(month, [0, 0])
+            total[0] += debt
+            total[1] += repaid
+    balance = 0
+    rows = []
+    for month in sorted(totals):
+        debt, repaid = totals[month]
+        balance += debt - repaid
+        rows.append((month, debt, repaid, balance))
+    return rows
+
+def yearly_rollup(months: list[tuple[int, int, int, int]]) -> list[tuple[int, int, int, int]]:
+    # The same, by calendar year, from monthly_rollup's rows
+    years = {}
+    for month, debt, repaid, balance in months:
+        year = years.setdefault(month // 12, [0, 0, 0])
+        year[0] += debt
+        year[1] += repaid
+        year[2] = balance
+    return [(year, *totals) for year, totals in years.items()]
+
+def latest_transactions(ledgers: dict[str, Ledger], count: int) -> list[tuple[str, Transaction]]:
+    # (user, transaction) for the newest transactions across the ledgers,
+    # newest first. Ledgers are kept in date order, so only the first count
+    # of each are looked at.
+    return list(islice(heapq.merge(
+        *([(name, txn) for txn in islice(ledger, count)] for name, ledger in ledgers.items()),
+        key=lambda entry: -entry[1].day
+    ), count))
+
+def assign_txn_ids(data: dict) -> bool:
+    # Returns whether any ids were assigned, i.e. whether data needs saving
+    assigned = False
+    for user in data.values():
+        assigned = user['transactions'].assign_ids() or assigned
+    return assigned
+
+def ledgers_from_json(data: dict) -> dict:
+    for user in data.values():
+        if not isinstance(user['transactions'], Ledger):
+            user['transactions'] = Ledger.from_json(user['transactions'])
+    return data
@@ -1,43 +1,177 @@
-from flask import Flask, request, session, redirect
+from flask import Flask, Response, request, session, redirect, g, jsonify
 import pyhtml as p
-import json
-import bcrypt
+import hashlib
+import heapq
+import metrics
 import os
-from datetime import datetime as dt
+import re
+import time
+from html import escape
+from urllib.parse import quote
+from datetime import date, datetime as dt
+from functools import lru_cache
+from accounts import MASTER_NAME, AccountRegistry
+from assets import AssetPipeline
+from backup import (
+    IMPORT_FORMATS, InvalidBackup, csv_chunks, jsonl_chunks, parse_transaction,
+    read_backup, read_import
+)
+from ledger import (
+    Ledger, TxnType, format_cents, latest_transactions, monthly_rollup, new_txn_id,
+    yearly_rollup
+)
+from passwords import (
+    PasswordBusy, check_password, hash_password, needs_rehash, password_stamp
+)
+from storage import DATA_FILES, JsonStorage, get_storage, json_chunks
 
 WEBSITE_NAME = 'Tally'
-DATA_FILE = 'data.json'
+HISTORY_PAGE_SIZE = 100
+# Rows in each of the dashboard's top debtors and recent activity lists
+DASHBOARD_ROWS = 10
+# Fingerprinted asset URLs never change content, so browsers may keep them
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+LEGACY_DATA_FILE = 'data.json'
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'json')
+DATA_FILE = os.environ.get('DATA_FILE', DATA_FILES.get(STORAGE_ENGINE, LEGACY_DATA_FILE))
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret")
+# A restore holds the whole backup in memory, at about five times its size
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", 16)) * 1024 * 1024
 
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'w') as f:
-        data = {
-            "Ethan Ryoo": {
-                "password": None,
-                "dark_mode": False,
-                "transactions": []
-            }
-        }
-        json.dump(data, f)
+initial_data = {
+    MASTER_NAME: {
+        "password": None,
+        "dark_mode": False,
+        "transactions": []
+    }
+}
+# An existing data.json seeds a fresh SQLite database or sharded store
+# (one-shot migration). It is read through its engine, so that changes still
+# in its journal come across too.
+if STORAGE_ENGINE != 'json' and os.path.exists(LEGACY_DATA_FILE):
+    initial_data = JsonStorage(LEGACY_DATA_FILE).read()
+
+storage = get_storage(STORAGE_ENGINE, DATA_FILE)
+storage.initialise(initial_data)
+# Data written before transactions had ids
+storage.assign_transaction_ids()
+accounts = AccountRegistry(storage)
+
+def load_data() -> dict:
+    # Parsed at most once per request; the storage engine also keeps a
+    # per-worker copy that is reused until the underlying data changes
+    if 'data' not in g:
+        with metrics.timed('load'):
+            g.data = storage.load()
+    return g.data
+
+def load_users() -> dict:
+    # Names and passwords only, which the sharded engine serves without
+    # loading anyone's ledger
+    if 'users' not in g:
+        with metrics.timed('load'):
+            g.users = storage.users()
+    return g.users
+
+def update_data(op: dict) -> None:
+    # Recorded alongside the change in the JSON engine's journal
+    op['by'] = session.get('name')
+    with metrics.timed('write'):
+        storage.apply(op)
+    g.pop('data', None)
+    g.pop('users', None)
+
+def render(response: p.html) -> str:
+    with metrics.timed('serialize'):
+        return str(response)
+
+class CachedFragment(p.Tag):
+    # Static markup that is rendered once for each place it appears in a
+    # page and then spliced in as ready-made lines on every later request
+    def __init__(self, *children):
+        super().__init__()
+        self.fragment = children
+        self.rendered = {}
+
+    def _get_tag_name(self) -> str:
+        return 'fragment'
+
+    def _render(self, indent: str, options, skip_indent: bool = False) -> list[str]:
+        key = (indent, options, skip_indent)
+        if key not in self.rendered:
+            self.rendered[key] = [
+                line
+                for child in self.fragment
+                for line in child._render(indent, options, skip_indent)
+            ]
+        return self.rendered[key]
+
+assets = AssetPipeline(app.static_folder)
+# The stylesheets each page links, in order. Each list is bundled into one
+# file here, once; the asset route only serves what was built up front.
+PAGE_STYLES = {
+    'Login': ['main', 'login'],
+    'Home': ['main'],
+    'Dashboard': ['main', 'dashboard'],
+    'History': ['main', 'history'],
+    'Statistics': ['main', 'statistics'],
+    'Settings': ['main', 'settings'],
+    'Master': ['main', 'master'],
+    'Edit': ['main', 'history', 'edit'],
+    'Edit transaction': ['main', 'master']
+}
+STYLE_URLS = {page_name: assets.bundle(styles) for page_name, styles in PAGE_STYLES.items()}
 
-def load_file(filename: str):
-    with open(filename) as f:
-        return json.load(f)
+if metrics.METRICS:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        metrics.begin_request()
 
-def write_file(filename: str, data) -> None:
-    with open(filename, 'w') as f:
-        json.dump(data, f)
+    @app.after_request
+    def record_request_time(response):
+        elapsed = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(
+            'tally_request_seconds', elapsed,
+            route=route, method=request.method, status=response.status_code)
+        # Whatever a page's view spends outside the other stages goes on
+        # building its pyhtml tree
+        if response.mimetype == 'text/html' and response.status_code == 200:
+            metrics.observe('tally_stage_seconds', elapsed - metrics.stage_time(), stage='build')
+        return response
 
-def load_icon(icon_name: str) -> str:
-    with open(f'static/icons/{icon_name}.svg') as f:
-        return p.DangerousRawHtml(f.read())
+@app.route('/assets/<path:name>')
+def serve_asset(name: str):
+    asset = assets.get(name)
+    if asset is None:
+        return 'No such asset', 404
+    encoding = request.accept_encodings.best_match(list(asset.encoded))
+    response = Response(asset.encoded.get(encoding, asset.body), mimetype=asset.mimetype)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    response.set_etag(f'{asset.digest}-{encoding or 'identity'}')
+    return response.make_conditional(request)
 
+def icon_maker(icon_name: str) -> p.DangerousRawHtml:
+    # Drawn from the sprite, which is fetched once and then cached
+    return p.DangerousRawHtml(
+        f'<svg class="icon" viewBox="{assets.view_boxes[icon_name]}">'
+        f'<use href="{assets.url('icons/sprite.svg')}#{icon_name}"/></svg>'
+    )
+
+@lru_cache
 def nav_bar_maker(page_name: str = None) -> list:
     PAGE_LIST = [
         'Home',
         'History',
+        'Statistics',
         'Settings',
         'Log out'
     ]
@@ -51,43 +185,46 @@ def nav_bar_maker(page_name: str = None) -> list:
             link_id='log_out_btn'
         nav_items.append(p.li(id=link_id)(
             p.a(href=f'/{page_file_name}')(
-                load_icon(page_file_name),
+                icon_maker(page_file_name),
                 page
             )
         ))
-    return [p.nav(
-        p.a(href='/home')(p.img(src="/static/icons/tally.svg", id="tally_logo", alt="Tally")),
+    return [CachedFragment(p.nav(
+        p.a(href='/home')(p.img(src=assets.url('icons/tally.svg'), id="tally_logo", alt="Tally")),
         p.input(type='checkbox', _class='nav_toggle', id='nav_toggle'),
         p.label(_for='nav_toggle', _class='burger')(
             [p.div() for _ in range(3)]
         ),
         p.ul(nav_items),
         p.label(_for='nav_toggle', _class='shader')()
-    )]
+    ))]
 
-def head_maker(page_name: str, special_css: bool = False) -> list:
+@lru_cache
+def head_maker(page_name: str) -> list:
     head = [
         p.meta(charset='UTF-8'),
         p.meta(name='viewport', content='width=device-width, initial-scale=1.0'),
         p.meta(name='description', content='A lightweight debt tracker for friends.'),
         p.meta(name='author', content='Ethan Ryoo'),
         p.title(f'{WEBSITE_NAME} | {page_name}'),
-        p.link(rel='icon', href='/static/icons/tally.svg', type='image/svg+xml'),
-        p.link(rel='stylesheet', href='/static/styles/main.css')
+        p.link(rel='icon', href=assets.url('icons/tally.svg'), type='image/svg+xml')
     ]
-    if page_name == 'Edit':
-        head.append(p.link(rel='stylesheet', href='/static/styles/history.css'))
-    if special_css:
-        head.append(p.link(rel='stylesheet', href=f'/static/styles/{page_name.lower()}.css'))
-    head.append(p.script(src='/static/main.js'))
-    return head
+    head.append(p.link(rel='stylesheet', href=STYLE_URLS[page_name]))
+    head.append(p.script(src=assets.url('main.js')))
+    return [CachedFragment(*head)]
+
+# Building the static chrome up front keeps it out of requests
+for page_name in ['Home', 'History', 'Statistics', 'Settings', None]:
+    nav_bar_maker(page_name)
 
 def select_options_maker(selected_name: str = None) -> list:
-    data = load_file(DATA_FILE)
     return [
         p.option(value="", disabled=True, selected=not(selected_name))(
             '-- Select a name --'),
-        [p.option(value=name, selected=(selected_name==name))(name) for name in data]
+        [
+            p.option(value=name, selected=(selected_name==name))(name)
+            for name in load_users()
+        ]
     ]
 
 def change_pw_form_maker(old_pw_exists: bool, old_pw_fill: str = '') -> list:
@@ -133,23 +270,88 @@ def remove_pw_form_maker(old_pw_exists: bool) -> list:
         ]
     return []
 
-def insert_transaction(transactions: list[dict], new_txn: dict) -> None:
-    new_txn_date = dt.strptime(new_txn['date'], '%Y-%m-%d')
-    for i, txn in enumerate(transactions):
-        if new_txn_date >= dt.strptime(txn['date'], '%Y-%m-%d'):
-            transactions.insert(i, new_txn)
-            return
-    transactions.append(new_txn)
-
-def txn_rows_maker(txns: list, interactive: bool = False, user: str = None) -> list:
-    totals = []
-    total = 0
+# Unbounded like month_key: one small entry per distinct day ever shown
+@lru_cache(maxsize=None)
+def format_date(day: int) -> str:
+    return date.fromordinal(day).strftime('%a %d/%m/%y')
+
+def page_start(txns: Ledger) -> int:
+    # The index of the first transaction shown, taken from ?start=
+    try:
+        start = int(request.args.get('start', 0))
+    except ValueError:
+        start = 0
+    last_page = (len(txns) - 1) // HISTORY_PAGE_SIZE * HISTORY_PAGE_SIZE
+    return min(max(start, 0), max(last_page, 0))
+
+def pagination_maker(txns: Ledger, start: int, user: str) -> list:
+    if len(txns) <= HISTORY_PAGE_SIZE:
+        return []
+    end = min(start + HISTORY_PAGE_SIZE, len(txns))
+    newer = p.a(href=f'?start={max(start - HISTORY_PAGE_SIZE, 0)}')('Newer')
+    older = p.a(href=f'?start={end}')('Older')
+    return [p.div(_class='pagination', **{'data-user': user})(
+        newer if start > 0 else p.span(),
+        p.p(f'{start + 1}–{end} of {len(txns)}'),
+        older if end < len(txns) else p.span()
+    )]
+
+def format_balance(cents: int) -> str:
+    return f'{'–' if cents < 0 else ''}${format_cents(abs(cents))}'
+
+def txn_row_strings(txns: Ledger, i: int) -> tuple[str, str, str]:
+    entry = txns[i]
+    date_str = format_date(entry.day)
+    amount_prefix = '–' if entry.type == TxnType.REPAYMENT else ''
+    amount_str = f'{amount_prefix}${format_cents(entry.cents)}'
+    balance_str = format_balance(txns.running_total(i))
+    return date_str, amount_str, balance_str
+
+def txn_json(txns: Ledger, i: int) -> dict:
+    date_str, amount_str, balance_str = txn_row_strings(txns, i)
+    return {
+        'index': i,
+        'id': txns[i].id,
+        'type': txns[i].type,
+        'date': date_str,
+        'amount': amount_str,
+        'desc': txns[i].desc,
+        'total': balance_str
+    }
+
+def txn_from_fields(fields) -> dict:
+    # From a form or API request; a blank description defaults to the type
+    txn = {field: fields.get(field) for field in ['type', 'date', 'amount']}
+    txn['desc'] = fields.get('desc') or str(txn['type']).capitalize()
+    return txn
+
+def valid_txn(fields, txn_id: str) -> dict:
+    # Raises InvalidBackup for a missing type, a bad date or a bad amount
+    txn = txn_from_fields(fields)
+    txn['id'] = txn_id
+    return parse_transaction(txn, 'transaction').to_json()
+
+def highlight_spans(text: str, query: str) -> list[list[int]]:
+    # Offsets are in UTF-16 code units, which is how JavaScript indexes strings
+    def js_len(string: str) -> int:
+        return len(string.encode('utf-16-le')) // 2
+    return [
+        [js_len(text[:match.start()]), js_len(text[:match.end()])]
+        for match in re.finditer(re.escape(query), text, re.IGNORECASE)
+    ]
+
+def txn_rows_maker(
+    txns: Ledger, interactive: bool = False, user: str = None, start: int = 0
+) -> list:
     if interactive:
         txn_rows = [p.p('Select a transaction below to edit.')]
     else:
         txn_rows = []
     txn_rows.extend([
-        p.input(type='text', id='search_input', placeholder='Filter by description...'),
+        p.input(
+            type='text', id='search_input', placeholder='Filter by description...',
+            **({'data-user': user} if interactive else {})
+        ),
         p.button(type='button', id='clear_button')('Clear'),
         p.div(_class='grid_container header', id='txn_header')(
             p.p('Date'),
@@ -159,52 +361,54 @@ def txn_rows_maker(txns: list, interactive: bool = False, user: str = None) -> l
         ),
         p.p(id='no_match_msg', _class='hidden')('No matching transactions found.')
     ])
-    for entry in reversed(txns):
-        if entry['type'] == 'debt':
-            total += float(entry['amount'])
-        else:
-            total -= float(entry['amount'])
-        totals.append(round(total, 2))
-    
-    for i, entry in enumerate(txns):
-        date_str = dt.strptime(entry['date'], '%Y-%m-%d').strftime('%a %d/%m/%y')
-        amount_prefix = '–' if entry['type'] == 'repayment' else ''
-        amount_str = f'{amount_prefix}${float(entry['amount']):.2f}'
-        balance = totals[len(totals)-i-1]
-        balance_str = f'{'–' if balance < 0 else ''}${abs(balance):.2f}'
-        desc = entry['desc']
-        css_class = f'grid_container {entry['type']}'
-        content = [
-            p.p(_class='date')(date_str),
-            p.p(_class='amount')(amount_str),
-            p.p(_class='desc')(desc),
-            p.p(_class='total')(
-                p.span(_class='total_owing_desc')('Total owing: '),
-                balance_str
-            )
-        ]
-        if interactive:
-            txn_rows.append(p.button(
-                _class=css_class, formaction=f'/edit/{user}/transaction_{i}',
-                **{'data-desc': desc})(content))
-        else:
-            txn_rows.append(p.div(_class=css_class, **{'data-desc': desc})(content))
+    txn_rows.append(TxnRows(txns, start, interactive, user))
     return txn_rows
 
-def compute_total_owing() -> float:
-    data = load_file(DATA_FILE)
-    total = 0
-    for entry in data[session['name']]['transactions']:
-        if entry['type'] == 'debt':
-            total += float(entry['amount'])
-        else:
-            total -= float(entry['amount'])
-    return round(total, 2)
+class TxnRows(p.Tag):
+    # A page of transaction rows written straight out as markup, rather than
+    # built from six pyhtml tags per row and walked again by str(). The
+    # output is what those tags rendered, except that descriptions keep
+    # their own line breaks instead of having each line re-indented.
+    def __init__(self, txns: Ledger, start: int, interactive: bool, user: str | None):
+        super().__init__()
+        self.txns = txns
+        self.start = start
+        self.interactive = interactive
+        self.user = user
 
-def txn_form_contents_maker(user: str = None, txn_index: int = None) -> list:
+    def _get_tag_name(self) -> str:
+        return 'txn-rows'
+
+    def _render(self, indent: str, options, skip_indent: bool = False) -> list[str]:
+        inner = indent + options.indent
+        tag = 'button' if self.interactive else 'div'
+        lines = []
+        # Running totals come from the ledger, so a page can start anywhere
+        for i in range(self.start, min(self.start + HISTORY_PAGE_SIZE, len(self.txns))):
+            entry = self.txns[i]
+            date_str, amount_str, balance_str = txn_row_strings(self.txns, i)
+            desc = escape(entry.desc)
+            action = ''
+            if self.interactive:
+                action = f'formaction="{escape(f'/edit/{self.user}/transaction/{entry.id}')}" '
+            lines += [
+                f'{indent}<{tag} {action}data-desc="{desc}" class="grid_container {entry.type}">',
+                f'{inner}<p class="date">{date_str}</p>',
+                f'{inner}<p class="amount">{amount_str}</p>',
+                f'{inner}<p class="desc">{desc}</p>',
+                f'{inner}<p class="total"><span class="total_owing_desc">Total owing: </span>'
+                f'{balance_str}</p>',
+                f'{indent}</{tag}>'
+            ]
+        return lines
+
+def compute_total_owing() -> int:
+    return load_data()[session['name']]['transactions'].balance
+
+def txn_form_contents_maker(user: str = None, txn_id: str = None) -> list:
     txn_form_contents = []
     if user:
-        txn = load_file(DATA_FILE)[user]['transactions'][int(txn_index)]
+        txn = load_data()[user]['transactions'].get(txn_id)
     else:
         txn_form_contents.extend([
             p.label(for_='user')('User:'),
@@ -215,33 +419,37 @@ def txn_form_contents_maker(user: str = None, txn_index: int = None) -> list:
         p.select(id='type', name='type')(
             p.option(
                 value='debt',
-                selected=(user and txn['type']=='debt')
+                selected=(user and txn.type==TxnType.DEBT)
             )('Debt'),
             p.option(
                 value='repayment',
-                selected=(user and txn['type']=='repayment')
+                selected=(user and txn.type==TxnType.REPAYMENT)
             )('Repayment')
         ),
         p.label(for_='amount', _class='mobile_gap')('Amount ($):'),
         p.input(
             type='number', min=0, step=0.01, id='amount',
-            name='amount', required=True, value=txn['amount'] if user else '' 
+            name='amount', required=True, value=format_cents(txn.cents) if user else '' 
         ),
         p.label(for_='date', _class='mobile_gap')('Date:'),
         p.input(
             type='date', id='date', name='date', max=dt.now().strftime('%Y-%m-%d'),
-            required=True, value=txn['date'] if user else '' 
+            required=True, value=txn.date if user else '' 
         ),
         p.label(for_='desc', _class='mobile_gap')('Description:'),
-        p.textarea(id='desc', name='desc', rows=3)(txn['desc'] if user else '')
+        p.textarea(id='desc', name='desc', rows=3)(txn.desc if user else '')
     ])
     return txn_form_contents
 
+@app.errorhandler(PasswordBusy)
+def password_busy(error):
+    return 'Too many sign-in attempts, please try again', 503, {'Retry-After': '1'}
+
 @app.route('/', methods=['GET', 'POST'])
 def redirect_page():
     # Signed-in users accidentally returning to this page
     if 'name' in session:
-        if session['name'] == 'Ethan Ryoo':
+        if accounts.is_master(session['name']):
             return redirect('/master')
         return redirect('/home')
     
@@ -250,19 +458,25 @@ def redirect_page():
         return redirect('/login')
     
     # Validating login credentials
-    data = load_file(DATA_FILE)
-    stored_pw = data[request.form['name']]['password']
-    if (
-        stored_pw is None
-        or bcrypt.checkpw(request.form['password'].encode(), stored_pw.encode())
-    ):
+    stored_pw = load_users()[request.form['name']]['password']
+    if stored_pw is None or check_password(request.form['password'], stored_pw):
         session['name'] = request.form['name']
+        # Upgrading hashes made before BCRYPT_ROUNDS last changed
+        if stored_pw and needs_rehash(stored_pw):
+            try:
+                stored_pw = hash_password(request.form['password'])
+                update_data({
+                    'op': 'set_password', 'name': session['name'], 'password': stored_pw
+                })
+            except PasswordBusy:
+                pass
+        session['pw_stamp'] = password_stamp(stored_pw)
     else:
         session['wrong_password'] = request.form['name']
 
     # Redirecting login attempts
     if 'name' in session:
-        if session['name'] == 'Ethan Ryoo':
+        if accounts.is_master(session['name']):
             return redirect('/master')
         return redirect('/home')
     return redirect('/login')
@@ -273,7 +487,7 @@ def login():
         return redirect('/home')
     
     PAGE_NAME = 'Login'
-    head = head_maker(page_name=PAGE_NAME, special_css=True)
+    head = head_maker(page_name=PAGE_NAME)
     message = p.p(class_='tooltip')('Leave blank if you haven\'t set a password')
     
     if session.get('wrong_password'):
@@ -298,23 +512,138 @@ def login():
             )
         )
     )
-    return str(response)
+    return render(response)
 
 def invalid_login(master_acc_required = False):
     if 'name' not in session:
         return True
-    data = load_file(DATA_FILE)
-    if session['name'] not in data:
+    account = accounts.get(session['name'])
+    if account is None:
+        session.clear()
+        return True
+    # Signs out sessions that began before the password last changed
+    if session.get('pw_stamp') != account.pw_stamp:
         session.clear()
         return True
-    if master_acc_required and session['name'] != 'Ethan Ryoo':
+    if master_acc_required and not account.is_master:
         return True
     return False
 
+# Pages also change with the code that renders them and the assets they link
+with open(__file__, 'rb') as f:
+    RENDER_VERSION = hashlib.blake2b(
+        f.read() + assets.version.encode(), digest_size=8).hexdigest()
+
+def page_etag(*parts) -> str | None:
+    # Pages showing only the signed-in user's data. The ledger's version
+    # changes with anything else about the user, e.g. dark mode.
+    version = load_data()[session['name']]['transactions'].version
+    if version is None:
+        return None
+    key = repr((RENDER_VERSION, session['name'], version, *parts))
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def not_modified(etag: str | None):
+    # Checked before rendering, so a revalidation never touches pyhtml
+    if etag is None or not request.if_none_match.contains(etag):
+        return None
+    return page_response('', etag, status=304)
+
+def page_response(html: str, etag: str | None, status: int = 200):
+    response = app.response_class(html, status=status, mimetype='text/html')
+    if etag is not None:
+        response.set_etag(etag)
+        # Pages are per user, and must be revalidated on every visit
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+    return response
+
+def dashboard():
+    # The master account's home page. Each ledger keeps its balance and date
+    # order up to date as it changes, so this reads a few figures per user
+    # rather than every transaction.
+    PAGE_NAME = 'Dashboard'
+    data = load_data()
+    ledgers = {
+        name: user['transactions'] for name, user in data.items() if name != session['name']
+    }
+    versions = tuple((name, ledger.version) for name, ledger in ledgers.items())
+    etag = None
+    if all(version is not None for _, version in versions):
+        etag = page_etag('dashboard', versions)
+    if cached := not_modified(etag):
+        return cached
+
+    total = sum(ledger.balance for ledger in ledgers.values())
+    debtors = heapq.nlargest(
+        DASHBOARD_ROWS,
+        ((name, ledger.balance) for name, ledger in ledgers.items() if ledger.balance > 0),
+        key=lambda debtor: debtor[1]
+    )
+    recent = latest_transactions(ledgers, DASHBOARD_ROWS)
+
+    debtors_list = [
+        p.div(_class='grid_container')(
+            p.a(href=f'/edit/{name}')(name),
+            p.p(format_balance(balance))
+        )
+        for name, balance in debtors
+    ] or p.p('Nobody owes anything.')
+    recent_list = [
+        p.div(_class=f'grid_container {txn.type}')(
+            p.p(format_date(txn.day)),
+            p.a(href=f'/edit/{name}')(name),
+            p.p(f'{'–' if txn.type == TxnType.REPAYMENT else ''}${format_cents(txn.cents)}'),
+            # Only the first line, as a reminder of what it was for
+            p.p(_class='desc')(txn.desc.split('\n', 1)[0])
+        )
+        for name, txn in recent
+    ] or p.p('There are no transactions yet.')
+    balances_list = [
+        p.div(_class='grid_container header')(
+            p.p('User'), p.p('Balance'), p.p('Transactions')
+        ),
+        *(
+            p.div(_class='grid_container')(
+                p.a(href=f'/edit/{name}')(name),
+                p.p(format_balance(ledger.balance)),
+                p.p(len(ledger))
+            )
+            for name, ledger in ledgers.items()
+        )
+    ]
+
+    head = head_maker(page_name=PAGE_NAME)
+    nav_bar = nav_bar_maker('Home')
+    response = p.html(
+        p.head(head),
+        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+            nav_bar,
+            p.div(id='main')(
+                p.h1(f'Welcome, {session['name'].split()[0]}!'),
+                p.p('Everyone together owes:'),
+                p.h2(format_balance(total)),
+                p.h3('Top debtors'),
+                p.div(id='debtors')(debtors_list),
+                p.h3('Recent activity'),
+                p.div(id='recent')(recent_list),
+                p.h3('All balances'),
+                p.div(id='balances')(balances_list)
+            )
+        )
+    )
+    return page_response(render(response), etag)
+
 @app.route('/home')
 def home():
     if invalid_login():
         return redirect('/login')
+    if accounts.is_master(session['name']):
+        return dashboard()
+    etag = page_etag('home')
+    if cached := not_modified(etag):
+        return cached
 
     PAGE_NAME = 'Home'
     total = compute_total_owing()
@@ -326,19 +655,19 @@ def home():
     
     head = head_maker(page_name=PAGE_NAME)
     nav_bar = nav_bar_maker(PAGE_NAME)
-    data = load_file(DATA_FILE)
+    user_data = load_data()[session['name']]
     response = p.html(
         p.head(head),
-        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+        p.body(class_='dark' if user_data['dark_mode'] else '')(
             nav_bar,
             p.div(id='main')(
                 p.h1(f'Welcome, {session['name'].split()[0]}!'),
                 p.p('Your current balance is:'),
-                p.h2(f'${total:.2f} {description}')
+                p.h2(f'${format_cents(total)} {description}')
             )
         )
     )
-    return str(response)
+    return page_response(render(response), etag)
 
 @app.route('/history')
 def history():
@@ -346,28 +675,127 @@ def history():
         return redirect('/login')
     
     PAGE_NAME = 'History'
-    data = load_file(DATA_FILE)
+    user_data = load_data()[session['name']]
     
-    if data[session['name']]['transactions']:
-        history_list = txn_rows_maker(
-            data[session['name']]['transactions'], interactive=False
-        )
+    transactions = user_data['transactions']
+    start = page_start(transactions)
+    etag = page_etag('history', start)
+    if cached := not_modified(etag):
+        return cached
+    if transactions:
+        history_list = txn_rows_maker(transactions, interactive=False, start=start)
     else:
         history_list = p.p('You have no transaction history.')
-    head = head_maker(page_name=PAGE_NAME, special_css=True)
+    head = head_maker(page_name=PAGE_NAME)
     nav_bar = nav_bar_maker(PAGE_NAME)
     
     response = p.html(
         p.head(head),
-        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+        p.body(class_='dark' if user_data['dark_mode'] else '')(
             nav_bar,
             p.div(id='main')(
                 p.h2('Transaction history'),
-                history_list
+                history_list,
+                pagination_maker(transactions, start, session['name'])
+            )
+        )
+    )
+    return page_response(render(response), etag)
+
+def rollup_rows_maker(rows: list[tuple[int, int, int, int]], label) -> list:
+    return [
+        p.div(_class='grid_container header')(
+            p.p(), p.p('Debt'), p.p('Repaid'), p.p('Balance')
+        ),
+        *(
+            p.div(_class='grid_container')(
+                p.p(_class='period')(label(period)),
+                p.p(f'${format_cents(debt)}'),
+                p.p(f'${format_cents(repaid)}'),
+                p.p(format_balance(balance))
             )
+            for period, debt, repaid, balance in reversed(rows)
         )
+    ]
+
+def trend_chart_maker(months: list[tuple[int, int, int, int]]) -> list:
+    # The balance at the end of each month, as a line scaled to fit the chart
+    WIDTH, HEIGHT = 600, 150
+    balances = [0] + [balance for *_, balance in months]
+    low, high = min(balances), max(balances)
+    scale = HEIGHT / ((high - low) or 1)
+    step = WIDTH / (len(balances) - 1)
+    points = ' '.join(
+        f'{i * step:.1f},{(high - balance) * scale:.1f}'
+        for i, balance in enumerate(balances)
     )
-    return str(response)
+    zero = high * scale
+    return [p.DangerousRawHtml(
+        f'<svg id="trend" viewBox="0 0 {WIDTH} {HEIGHT}" preserveAspectRatio="none">'
+        f'<line x1="0" y1="{zero:.1f}" x2="{WIDTH}" y2="{zero:.1f}"/>'
+        f'<polyline points="{points}"/></svg>'
+    )]
+
+@app.route('/statistics')
+def statistics():
+    if invalid_login():
+        return redirect('/login')
+
+    PAGE_NAME = 'Statistics'
+    data = load_data()
+    is_master = not invalid_login(master_acc_required=True)
+    # The master account sees everyone's totals unless it picks a user
+    user = request.args.get('user') or None if is_master else session['name']
+    if user is not None and user not in data:
+        return redirect('/statistics')
+    names = [user] if user is not None else list(data)
+    etag = None
+    # The master's page lists every user, so it changes with any of them
+    versions = tuple(
+        (name, record['transactions'].version) for name, record in data.items()
+    ) if is_master else ()
+    if all(version is not None for _, version in versions):
+        etag = page_etag('statistics', user, versions)
+    if cached := not_modified(etag):
+        return cached
+    months = monthly_rollup(data[name]['transactions'] for name in names)
+
+    if months:
+        statistics_list = [
+            p.h3('Balance over time'),
+            *trend_chart_maker(months),
+            p.h3('By year'),
+            *rollup_rows_maker(yearly_rollup(months), str),
+            p.h3('By month'),
+            *rollup_rows_maker(
+                months, lambda month: date(month // 12, month % 12 + 1, 1).strftime('%b %Y'))
+        ]
+    else:
+        statistics_list = p.p('There are no transactions yet.')
+    user_select = []
+    if is_master:
+        user_select = p.form(action='/statistics', method='get', id='user_select')(
+            p.select(name='user')(
+                p.option(value='', selected=user is None)('All users'),
+                [p.option(value=name, selected=name == user)(name) for name in data]
+            ),
+            p.input(type='submit', value='Show')
+        )
+    head = head_maker(page_name=PAGE_NAME)
+    nav_bar = nav_bar_maker(PAGE_NAME)
+
+    response = p.html(
+        p.head(head),
+        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+            nav_bar,
+            p.div(id='main')(
+                p.h2('Statistics'),
+                user_select,
+                statistics_list
+            )
+        )
+    )
+    return page_response(render(response), etag)
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -375,21 +803,20 @@ def settings():
         return redirect('/login')
 
     PAGE_NAME = 'Settings'
-    head = head_maker(PAGE_NAME, special_css=True)
+    head = head_maker(PAGE_NAME)
     nav_bar = nav_bar_maker(PAGE_NAME)
-    data = load_file(DATA_FILE)
+    user_data = load_data()[session['name']]
     old_password = ''
     incorrect_pw = ''
     pw_mismatch = ''
     pw_change_success = ''
     incorrect_remove_pw = ''
     pw_remove_success = ''
-    stored_pw = data[session['name']]['password']
-    dark_mode = data[session['name']]['dark_mode']
+    stored_pw = user_data['password']
+    dark_mode = user_data['dark_mode']
 
     if 'password_reset' in request.form:
-        if stored_pw and not bcrypt.checkpw(
-            request.form['old_password'].encode(), stored_pw.encode()):
+        if stored_pw and not check_password(request.form['old_password'], stored_pw):
             incorrect_pw = p.p(_class='error tooltip', id='incorrect_pw')(
                 'Incorrect password')
         elif request.form['new_password'] != request.form['confirm_new_password']:
@@ -400,24 +827,27 @@ def settings():
             pw_change_success = p.p(
                 _class='success tooltip', id='pw_change_success'
                 )('Your password has been changed')
-            hashed_new_pw = bcrypt.hashpw(
-                request.form['new_password'].encode(), bcrypt.gensalt()).decode()
-            data[session['name']]['password'] = hashed_new_pw
-            write_file(DATA_FILE, data)
+            hashed_new_pw = hash_password(request.form['new_password'])
+            update_data({
+                'op': 'set_password', 'name': session['name'], 'password': hashed_new_pw
+            })
+            session['pw_stamp'] = password_stamp(hashed_new_pw)
+            stored_pw = hashed_new_pw
     
     elif 'remove_pw_submit' in request.form:
-        if bcrypt.checkpw(request.form['remove_pw'].encode(), stored_pw.encode()):
+        if check_password(request.form['remove_pw'], stored_pw):
             pw_remove_success = p.p(
                 _class='success tooltip', id='pw_remove_success'
                 )('Your password has been removed')
-            data[session['name']]['password'] = None
-            write_file(DATA_FILE, data)
+            update_data({'op': 'set_password', 'name': session['name'], 'password': None})
+            session['pw_stamp'] = password_stamp(None)
+            stored_pw = None
         else:
             incorrect_remove_pw = p.p(
                 _class='error tooltip', id='incorrect_remove_pw'
                 )('Incorrect password')
     
-    old_pw_exists=bool(data[session['name']]['password'])
+    old_pw_exists=bool(stored_pw)
     change_pw_form = change_pw_form_maker(old_pw_exists, old_password)
     remove_pw_form = remove_pw_form_maker(old_pw_exists)
     
@@ -449,7 +879,7 @@ def settings():
             )
         )
     )
-    return str(response)
+    return render(response)
 
 @app.route('/master', methods=['GET', 'POST'])
 def master():
@@ -459,21 +889,16 @@ def master():
     PAGE_NAME = 'Master'
     user_alr_exists = ''
     nav_bar = nav_bar_maker()
-    head = head_maker(PAGE_NAME, special_css=True)
+    head = head_maker(PAGE_NAME)
     txn_form = txn_form_contents_maker()
-    data  = load_file(DATA_FILE)
+    user_data = load_data()[session['name']]
 
     if 'transaction_submit' in request.form:
-        new_txn = {
-            field: request.form[field]
-            for field in ['type', 'date', 'amount']
-        }
-        if request.form['desc']:
-            new_txn['desc'] = request.form['desc']
-        else:
-            new_txn['desc'] = request.form['type'].capitalize()
-        insert_transaction(data[request.form['user']]['transactions'], new_txn)
-        write_file(DATA_FILE, data)
+        try:
+            new_txn = valid_txn(request.form, new_txn_id())
+        except InvalidBackup as e:
+            return f'Invalid transaction: {e}', 400
+        update_data({'op': 'add_txn', 'name': request.form['user'], 'txn': new_txn})
     
     elif 'edit_user_submit' in request.form:
         return redirect(f'/edit/{request.form['edit_user']}')
@@ -484,21 +909,16 @@ def master():
             + ' '
             + request.form['last_name'].strip().lower().title()
         )
-        if name in data:
+        if name in load_users():
             user_alr_exists = p.p(
                 class_='error tooltip', id='user_alr_exists'
                 )('The user', p.em(name), 'already exists')
         else:
             if request.form['password']:
-                password = bcrypt.hashpw(request.form['password'].encode(), bcrypt.gensalt()).decode()
+                password = hash_password(request.form['password'])
             else:
                 password = None
-            data[name] = {
-                'password': password,
-                'dark_mode': False,
-                'transactions': []
-            }
-            write_file(DATA_FILE, data)
+            update_data({'op': 'add_user', 'name': name, 'password': password})
     
     elif 'data_file_submit' in request.form:
         file = request.files.get('data_file')
@@ -507,13 +927,34 @@ def master():
         if not file.filename.endswith('.json'):
             return 'Invalid file type', 400
         try:
-            write_file(DATA_FILE, json.load(file))
-        except Exception as e:
+            data = read_backup(file.stream)
+        except InvalidBackup as e:
             return f'Upload failed: {e}', 400
+        if session['name'] not in data:
+            return f'Upload failed: the backup has no account for {session['name']}', 400
+        # Replaces everything in one step, so a failed upload changes nothing
+        with metrics.timed('write'):
+            storage.save(data)
+        g.pop('data', None)
+        g.pop('users', None)
+
+    elif 'txn_file_submit' in request.form:
+        file = request.files.get('txn_file')
+        if not file:
+            return 'No file selected', 400
+        file_type = file.filename.rsplit('.', 1)[-1].lower()
+        if file_type not in IMPORT_FORMATS:
+            return 'Invalid file type', 400
+        try:
+            txns = read_import(file.stream, file_type, load_data())
+        except InvalidBackup as e:
+            return f'Import failed: {e}', 400
+        # Every user's transactions are merged in and saved in one write
+        update_data({'op': 'import_txns', 'txns': txns})
 
     response = p.html(
         p.head(head),
-        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+        p.body(class_='dark' if user_data['dark_mode'] else '')(
             nav_bar,
             p.div(id='main')(
                 p.form(action='/master')(
@@ -546,13 +987,21 @@ def master():
                 p.form(action='/master', enctype='multipart/form-data')(
                     p.h2('Replace server data'),
                     p.input(type='file', name='data_file', accept='.json', required=True),
+                    p.p(class_='tooltip')(p.a(href='/export')('Download a backup first')),
                     p.input(type='submit', name='data_file_submit', value='Upload',
                         onclick='return confirm("This will replace all server data. Continue?");')
+                ),
+                p.form(action='/master', enctype='multipart/form-data')(
+                    p.h2('Import transactions'),
+                    p.input(type='file', name='txn_file', accept='.csv,.jsonl', required=True),
+                    p.p(class_='tooltip')(
+                        'CSV or JSON lines with user, type, date, amount and desc'),
+                    p.input(type='submit', name='txn_file_submit', value='Import')
                 )
             )
         )
     )
-    return str(response)
+    return render(response)
 
 @app.route('/edit/<user>', methods=['GET', 'POST'])
 def edit(user):
@@ -562,69 +1011,73 @@ def edit(user):
     PAGE_NAME = 'Edit'
 
     if request.method == 'POST':
-        data = load_file(DATA_FILE)
-        index = int(request.form.get('txn_index'))
+        txn_id = request.form.get('txn_id')
+        if txn_id not in load_data()[user]['transactions']:
+            return 'No such transaction', 404
         if 'txn_edit_submit' in request.form:
-            new_txn = {
-                field: request.form[field]
-                for field in ['type', 'date', 'amount']
-            }
-            if request.form['desc']:
-                new_txn['desc'] = request.form['desc']
-            else:
-                new_txn['desc'] = request.form['type'].capitalize()
-            if request.form['date'] == data[user]['transactions'][index]['date']:
-                data[user]['transactions'][index] = new_txn
-            else:
-                data[user]['transactions'].pop(index)
-                insert_transaction(data[user]['transactions'], new_txn)
+            try:
+                new_txn = valid_txn(request.form, txn_id)
+            except InvalidBackup as e:
+                return f'Invalid transaction: {e}', 400
+            update_data({'op': 'edit_txn', 'name': user, 'id': txn_id, 'txn': new_txn})
         elif 'txn_delete' in request.form:
-            data[user]['transactions'].pop(index)
-        write_file(DATA_FILE, data)
+            update_data({'op': 'delete_txn', 'name': user, 'id': txn_id})
 
-    # Loading the (potentially) updated database
-    data = load_file(DATA_FILE)
-    if data[user]['transactions']:
-        edit_form = p.form(txn_rows_maker(data[user]['transactions'], interactive=True, user=user))
+    # Loading the (potentially) updated ledger
+    transactions = load_data()[user]['transactions']
+    start = page_start(transactions)
+    if transactions:
+        edit_form = p.form(
+            txn_rows_maker(transactions, interactive=True, user=user, start=start))
     else:
         edit_form = p.p('No records found')
     nav_bar = nav_bar_maker()
-    head = head_maker(PAGE_NAME, special_css=True)
+    head = head_maker(PAGE_NAME)
     
     response = p.html(
         p.head(head),
-        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+        p.body(class_='dark' if load_data()[session['name']]['dark_mode'] else '')(
             nav_bar,
             p.div(id='main')(
                 p.h2(f'{user}\'s transaction history'),
-                edit_form
+                edit_form,
+                pagination_maker(transactions, start, user)
             )
         )
     )
-    return str(response)
+    return render(response)
+
+@app.route('/edit/<user>/transaction_<int:i>', methods=['GET', 'POST'])
+def edit_transaction_by_index(user, i):
+    # Old links addressed transactions by their position in the history
+    if invalid_login(master_acc_required=True):
+        return redirect('/login')
+    transactions = load_data()[user]['transactions']
+    if not 0 <= i < len(transactions):
+        return 'No such transaction', 404
+    return redirect(f'/edit/{user}/transaction/{transactions[i].id}')
 
-@app.route('/edit/<user>/transaction_<i>', methods=['GET', 'POST'])
-def edit_transaction(user, i):
+@app.route('/edit/<user>/transaction/<txn_id>', methods=['GET', 'POST'])
+def edit_transaction(user, txn_id):
     if invalid_login(master_acc_required=True):
         return redirect('/login')
+    if txn_id not in load_data()[user]['transactions']:
+        return 'No such transaction', 404
 
     PAGE_NAME = 'Edit transaction'
     nav_bar = nav_bar_maker()
     head = head_maker(PAGE_NAME)
-    txn_form = txn_form_contents_maker(user=user, txn_index=i)
-    data = load_file(DATA_FILE)
+    txn_form = txn_form_contents_maker(user=user, txn_id=txn_id)
+    user_data = load_data()[session['name']]
     response = p.html(
-        p.head(
-            head,
-            p.link(rel='stylesheet', href='/static/styles/master.css')
-        ),
-        p.body(class_='dark' if data[session['name']]['dark_mode'] else '')(
+        p.head(head),
+        p.body(class_='dark' if user_data['dark_mode'] else '')(
             nav_bar,
             p.div(id='main')(
                 p.form(action=f'/edit/{user}')(
                     p.h2(f'Editing a transaction for {user}'),
                     p.div(id='transaction', _class='grid_container')(txn_form),
-                    p.input(type='hidden', name='txn_index', value=i),
+                    p.input(type='hidden', name='txn_id', value=txn_id),
                     p.input(type='submit', id='txn_edit_submit', name='txn_edit_submit'),
                     p.input(
                         type='submit', id='txn_delete', name='txn_delete', value='Delete transaction',
@@ -634,13 +1087,182 @@ def edit_transaction(user, i):
             )
         )
     )
-    return str(response)
+    return render(response)
+
+EXPORT_FORMATS = {
+    'json': ('application/json', json_chunks),
+    'csv': ('text/csv', csv_chunks),
+    'jsonl': ('application/jsonl', jsonl_chunks)
+}
+
+@app.route('/export')
+@app.route('/export/<user>')
+def export(user=None):
+    if invalid_login():
+        return redirect('/login')
+    if user != session['name'] and invalid_login(master_acc_required=True):
+        return 'Forbidden', 403
+    data = load_data()
+    if user is not None and user not in data:
+        return 'No such user', 404
+    file_type = request.args.get('format', 'json')
+    if file_type not in EXPORT_FORMATS:
+        return 'Unknown format', 400
+
+    # Later writes update the cached ledgers in place, so the export works
+    # from copies taken now
+    names = [user] if user else list(data)
+    if file_type == 'json':
+        users = {
+            name: {**data[name], 'transactions': list(data[name]['transactions'])}
+            for name in names
+        }
+    else:
+        users = {name: list(data[name]['transactions']) for name in names}
+    mimetype, chunks = EXPORT_FORMATS[file_type]
+    filename = f'{user or WEBSITE_NAME.lower()}-{date.today()}.{file_type}'
+    return Response(chunks(users), mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"
+    })
+
+@app.route('/search')
+def search():
+    if invalid_login():
+        return redirect('/login')
+
+    user = request.args.get('user', session['name'])
+    if user != session['name'] and invalid_login(master_acc_required=True):
+        return 'Forbidden', 403
+    if user not in load_data():
+        return 'No such user', 404
+
+    txns = load_data()[user]['transactions']
+    query = request.args.get('q', '').strip()
+    # An empty query would match every transaction
+    matches = txns.search(query) if query else []
+    results = []
+    for i in matches[:HISTORY_PAGE_SIZE]:
+        results.append({
+            **txn_json(txns, i),
+            'highlights': highlight_spans(txns[i].desc, query)
+        })
+    return jsonify(query=query, count=len(matches), results=results)
+
+# JSON API. Responses carry only what an action changed, for main.js to
+# patch into the page.
+
+def api_error(message: str, status: int):
+    return jsonify(error=message), status
+
+def api_user(user: str, write: bool = False):
+    # An error response if the session may not use this user's data
+    if invalid_login():
+        return api_error('Not signed in', 401)
+    if (write or user != session['name']) and invalid_login(master_acc_required=True):
+        return api_error('Forbidden', 403)
+    if user not in load_data():
+        return api_error('No such user', 404)
+    return None
+
+def api_txn(txn_id: str = None) -> dict:
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise InvalidBackup('Expected a JSON object')
+    return valid_txn(body, txn_id or new_txn_id())
+
+def api_txn_response(user: str, txn_id: str, status: int = 200):
+    txns = load_data()[user]['transactions']
+    return jsonify(
+        transaction=txn_json(txns, txns.index_of(txns.get(txn_id))),
+        balance=format_cents(txns.balance)
+    ), status
+
+@app.route('/api/users/<user>/balance')
+def api_balance(user):
+    if error := api_user(user):
+        return error
+    return jsonify(user=user, balance=format_cents(load_data()[user]['transactions'].balance))
+
+@app.route('/api/users/<user>/transactions')
+def api_transactions(user):
+    if error := api_user(user):
+        return error
+    txns = load_data()[user]['transactions']
+    start = page_start(txns)
+    return jsonify(
+        user=user,
+        start=start,
+        count=len(txns),
+        page_size=HISTORY_PAGE_SIZE,
+        balance=format_cents(txns.balance),
+        transactions=[
+            txn_json(txns, i)
+            for i in range(start, min(start + HISTORY_PAGE_SIZE, len(txns)))
+        ]
+    )
+
+@app.route('/api/users/<user>/transactions', methods=['POST'])
+def api_add_transaction(user):
+    if error := api_user(user, write=True):
+        return error
+    try:
+        new_txn = api_txn()
+    except InvalidBackup as e:
+        return api_error(str(e), 400)
+    update_data({'op': 'add_txn', 'name': user, 'txn': new_txn})
+    return api_txn_response(user, new_txn['id'], 201)
+
+@app.route('/api/users/<user>/transactions/<txn_id>', methods=['PUT'])
+def api_edit_transaction(user, txn_id):
+    if error := api_user(user, write=True):
+        return error
+    if txn_id not in load_data()[user]['transactions']:
+        return api_error('No such transaction', 404)
+    try:
+        new_txn = api_txn(txn_id)
+    except InvalidBackup as e:
+        return api_error(str(e), 400)
+    update_data({'op': 'edit_txn', 'name': user, 'id': txn_id, 'txn': new_txn})
+    return api_txn_response(user, txn_id)
+
+@app.route('/api/users/<user>/transactions/<txn_id>', methods=['DELETE'])
+def api_delete_transaction(user, txn_id):
+    if error := api_user(user, write=True):
+        return error
+    if txn_id not in load_data()[user]['transactions']:
+        return api_error('No such transaction', 404)
+    update_data({'op': 'delete_txn', 'name': user, 'id': txn_id})
+    return jsonify(
+        deleted=txn_id,
+        balance=format_cents(load_data()[user]['transactions'].balance)
+    )
+
+@app.route('/api/preferences', methods=['GET', 'PATCH'])
+def api_preferences():
+    if invalid_login():
+        return api_error('Not signed in', 401)
+    if request.method == 'PATCH':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('dark_mode'), bool):
+            return api_error('Expected {"dark_mode": true or false}', 400)
+        update_data({
+            'op': 'set_dark_mode', 'name': session['name'], 'dark_mode': body['dark_mode']
+        })
+    return jsonify(dark_mode=load_data()[session['name']]['dark_mode'])
+
+@app.route('/metrics')
+def metrics_page():
+    if not metrics.METRICS:
+        return 'Metrics are disabled; set METRICS=1 to enable them', 404
+    if invalid_login(master_acc_required=True):
+        return 'Only the master account can view metrics', 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/toggle_dark_mode', methods=['POST'])
 def toggle_dark_mode():
-    data = load_file(DATA_FILE)
-    data[session['name']]['dark_mode'] = not data[session['name']]['dark_mode']
-    write_file(DATA_FILE, data)
+    if invalid_login():
+        return 'Not signed in', 401
+    update_data({'op': 'toggle_dark_mode', 'name': session['name']})
     return 'Success', 200
 
 @app.route('/log_out')
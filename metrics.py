@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# Off unless METRICS=1. When off, timed() hands back one shared do-nothing
+# context manager and count() returns straight away, so instrumented code
+# costs a function call. Figures are kept per process: with several
+# gunicorn workers, each scrape sees the worker that served it.
+METRICS = os.environ.get('METRICS') == '1'
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_local = threading.local()
+_disabled = nullcontext()
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        # One count per bucket plus one for +Inf, not cumulative
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.counts[bisect_left(BUCKETS, seconds)] += 1
+        histogram.sum += seconds
+
+def count(name: str, amount: float, **labels) -> None:
+    if not METRICS:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def begin_request() -> None:
+    _local.stage_time = 0.0
+    _local.depth = 0
+
+def stage_time() -> float:
+    # Time this thread has spent in stages since begin_request(), not
+    # counting stages within stages
+    return getattr(_local, 'stage_time', 0.0)
+
+@contextmanager
+def _stage(stage: str):
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.depth = depth
+        if not depth:
+            _local.stage_time = stage_time() + elapsed
+        observe('tally_stage_seconds', elapsed, stage=stage)
+
+def timed(stage: str):
+    if not METRICS:
+        return _disabled
+    return _stage(stage)
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+def render() -> str:
+    # Prometheus text exposition format
+    with _lock:
+        histograms = sorted(
+            (key, list(histogram.counts), histogram.sum)
+            for key, histogram in _histograms.items())
+        counters = sorted(_counters.items())
+    lines = []
+    last_name = None
+    for (name, labels), counts, total in histograms:
+        if name != last_name:
+            lines.append(f'# TYPE {name} histogram')
+            last_name = name
+        cumulative = 0
+        for bound, bucket_count in zip((*BUCKETS, '+Inf'), counts):
+            cumulative += bucket_count
+            lines.append(
+                f'{name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+        lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    for (name, labels), value in counters:
+        if name != last_name:
+            lines.append(f'# TYPE {name} counter')
+            last_name = name
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
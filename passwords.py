@@ -0,0 +1,60 @@
+import bcrypt
+import hashlib
+import metrics
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# bcrypt releases the GIL, so hashing on a few threads leaves the worker's
+# other request threads free to render pages. Work beyond the pool and its
+# queue is refused rather than left to pile up behind a burst of sign-ins.
+# Together they must stay below the request threads per worker (8 in the
+# Procfile, and ASYNC_THREADS) or sign-ins can still take every thread.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_THREADS = int(os.environ.get('PASSWORD_THREADS', 2))
+PASSWORD_QUEUE = int(os.environ.get('PASSWORD_QUEUE', 2))
+PASSWORD_TIMEOUT = float(os.environ.get('PASSWORD_TIMEOUT', 10))
+
+_executor = ThreadPoolExecutor(PASSWORD_THREADS, thread_name_prefix='bcrypt')
+_admission = threading.BoundedSemaphore(PASSWORD_THREADS + PASSWORD_QUEUE)
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+def _run(fn, *args):
+    if not _admission.acquire(blocking=False):
+        raise PasswordBusy('Too many password checks in progress')
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _admission.release()
+        raise
+    # The slot is held until the work itself finishes, even if the caller
+    # has stopped waiting for it, so timed-out checks still count
+    future.add_done_callback(lambda _: _admission.release())
+    try:
+        # Includes any wait for a free thread
+        with metrics.timed('bcrypt'):
+            return future.result(timeout=PASSWORD_TIMEOUT)
+    except TimeoutError:
+        raise PasswordBusy('Timed out waiting for a password check')
+
+def hash_password(password: str) -> str:
+    return _run(
+        lambda: bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode())
+
+def check_password(password: str, hashed: str) -> bool:
+    return _run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+def needs_rehash(hashed: str) -> bool:
+    # Hashes look like $2b$12$..., where 12 is the cost they were made with
+    return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+
+def password_stamp(hashed: str | None) -> str:
+    # Kept in the session once the password has been checked, so that later
+    # requests can tell the password hasn't changed without running bcrypt
+    if hashed is None:
+        return ''
+    return hashlib.blake2b(hashed.encode(), digest_size=8).hexdigest()
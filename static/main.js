@@ -1,42 +1,65 @@
 document.addEventListener('DOMContentLoaded', () => {
+    function sendJson(url, method, body) {
+        return fetch(url, {
+            method: method,
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+    }
+
     // Dark mode toggle
     const toggle = document.getElementById('dark_mode_toggle');
     if (toggle) {
-        toggle.addEventListener('change', () => {
-            fetch('/toggle_dark_mode', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' }
-            });
-            document.body.classList.toggle('dark');
+        toggle.addEventListener('change', async () => {
+            document.body.classList.toggle('dark', toggle.checked);
+            const response = await sendJson(
+                '/api/preferences', 'PATCH', { dark_mode: toggle.checked });
+            if (response.ok) {
+                const { dark_mode } = await response.json();
+                toggle.checked = dark_mode;
+                document.body.classList.toggle('dark', dark_mode);
+            }
+        });
+    }
+
+    // Adding a transaction on the master page without reloading it
+    const txnForm = document.getElementById('transaction_submit')?.form;
+    if (txnForm) {
+        const message = document.createElement('p');
+        txnForm.append(message);
+        txnForm.addEventListener('submit', async event => {
+            event.preventDefault();
+            const fields = Object.fromEntries(new FormData(txnForm));
+            const response = await sendJson(
+                `/api/users/${encodeURIComponent(fields.user)}/transactions`, 'POST', fields);
+            const result = await response.json();
+            if (response.ok) {
+                message.className = 'success tooltip';
+                message.textContent = `Added ${result.transaction.amount} for ${fields.user}`;
+                txnForm.elements.amount.value = '';
+                txnForm.elements.desc.value = '';
+            } else {
+                message.className = 'error tooltip';
+                message.textContent = result.error;
+            }
         });
     }
 
-    // Filter transactions
+    // Filter transactions (searched on the server, which indexes the
+    // whole ledger rather than just the page that is shown)
     const input = document.getElementById('search_input');
     const clearButton = document.getElementById('clear_button');
     if (input) {
-        function escapeRegExp(string) {
-            return string.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
-        }
-        function filterByDescription() {
-            const entries = document.querySelectorAll('[data-desc]');
-            const query = input.value.trim().toLowerCase();
-            const txnHeader = document.getElementById('txn_header');
-            const noMatchMsg = document.getElementById('no_match_msg');
-            let foundMatch = false;
-            entries.forEach(entry => {
-                const desc = entry.getAttribute('data-desc');
-                const textBox = entry.querySelector('.desc');
-                if (desc.toLowerCase().includes(query)) {
-                    const anyCaseQuery = new RegExp(`(${escapeRegExp(query)})`, 'gi');
-                    textBox.innerHTML = desc.replaceAll(
-                        anyCaseQuery, `<span class='highlight'>$1</span>`);
-                    foundMatch = true;
-                    entry.style.display = '';
-                } else {
-                    entry.style.display = 'none';
-                }
-            });
+        const user = input.dataset.user;
+        const txnHeader = document.getElementById('txn_header');
+        const noMatchMsg = document.getElementById('no_match_msg');
+        const pagination = document.querySelector('.pagination');
+        let pageRows = Array.from(document.querySelectorAll('[data-desc]'));
+        let resultRows = [];
+        let latestSearch = 0;
+        let searchTimer;
+
+        function showMatchFound(foundMatch) {
             if (foundMatch) {
                 noMatchMsg.classList.add('hidden');
                 txnHeader.classList.remove('hidden');
@@ -45,23 +68,141 @@ document.addEventListener('DOMContentLoaded', () => {
                 txnHeader.classList.add('hidden');
             }
         }
-        input.addEventListener('input', filterByDescription);
+        function textWithHighlights(text, highlights) {
+            const desc = document.createElement('p');
+            desc.className = 'desc';
+            let end = 0;
+            highlights.forEach(([start, stop]) => {
+                desc.append(text.slice(end, start));
+                const highlight = document.createElement('span');
+                highlight.className = 'highlight';
+                highlight.textContent = text.slice(start, stop);
+                desc.append(highlight);
+                end = stop;
+            });
+            desc.append(text.slice(end));
+            return desc;
+        }
+        function resultRow(result) {
+            const row = document.createElement(user ? 'button' : 'div');
+            row.className = `grid_container ${result.type}`;
+            row.dataset.desc = result.desc;
+            if (user) {
+                row.setAttribute('formaction', `/edit/${user}/transaction/${result.id}`);
+            }
+            const date = document.createElement('p');
+            date.className = 'date';
+            date.textContent = result.date;
+            const amount = document.createElement('p');
+            amount.className = 'amount';
+            amount.textContent = result.amount;
+            const total = document.createElement('p');
+            total.className = 'total';
+            const totalDesc = document.createElement('span');
+            totalDesc.className = 'total_owing_desc';
+            totalDesc.textContent = 'Total owing: ';
+            total.append(totalDesc, result.total);
+            row.append(
+                date, amount, textWithHighlights(result.desc, result.highlights || []), total);
+            return row;
+        }
+        function showPage() {
+            resultRows.forEach(row => row.remove());
+            resultRows = [];
+            pageRows.forEach(row => row.style.display = '');
+            if (pagination) {
+                pagination.style.display = '';
+            }
+            showMatchFound(pageRows.length > 0);
+        }
+        async function filterByDescription() {
+            const search = ++latestSearch;
+            const query = input.value.trim();
+            if (!query) {
+                showPage();
+                return;
+            }
+            const params = new URLSearchParams({ q: query });
+            if (user) {
+                params.set('user', user);
+            }
+            const response = await fetch(`/search?${params}`);
+            // Ignore responses overtaken by a later keystroke
+            if (!response.ok || search !== latestSearch) {
+                return;
+            }
+            const { results } = await response.json();
+            if (search !== latestSearch) {
+                return;
+            }
+            resultRows.forEach(row => row.remove());
+            pageRows.forEach(row => row.style.display = 'none');
+            if (pagination) {
+                pagination.style.display = 'none';
+            }
+            resultRows = results.map(resultRow);
+            noMatchMsg.after(...resultRows);
+            showMatchFound(resultRows.length > 0);
+        }
+        // Paging through the history fetches just the rows of the new page
+        function pageLink(text, start) {
+            const link = document.createElement('a');
+            link.href = `?start=${start}`;
+            link.textContent = text;
+            return link;
+        }
+        async function showPageAt(start, push = true) {
+            const response = await fetch(
+                `/api/users/${encodeURIComponent(pagination.dataset.user)}/transactions?start=${start}`);
+            if (!response.ok) {
+                location.search = `?start=${start}`;
+                return;
+            }
+            const page = await response.json();
+            pageRows.forEach(row => row.remove());
+            pageRows = page.transactions.map(resultRow);
+            noMatchMsg.after(...pageRows);
+            const end = Math.min(page.start + page.page_size, page.count);
+            const range = document.createElement('p');
+            range.textContent = `${page.start + 1}–${end} of ${page.count}`;
+            pagination.replaceChildren(
+                page.start > 0
+                    ? pageLink('Newer', Math.max(page.start - page.page_size, 0))
+                    : document.createElement('span'),
+                range,
+                end < page.count ? pageLink('Older', end) : document.createElement('span')
+            );
+            if (push) {
+                history.pushState({ start: page.start }, '', `?start=${page.start}`);
+            }
+            input.value = '';
+            showPage();
+            window.scrollTo(0, 0);
+        }
+        if (pagination) {
+            pagination.addEventListener('click', event => {
+                const link = event.target.closest('a');
+                if (link) {
+                    event.preventDefault();
+                    showPageAt(new URL(link.href).searchParams.get('start'));
+                }
+            });
+            window.addEventListener('popstate', event => {
+                const start = event.state?.start
+                    ?? new URLSearchParams(location.search).get('start') ?? 0;
+                showPageAt(start, false);
+            });
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(filterByDescription, 150);
+        });
         clearButton.addEventListener('click', () => {
+            clearTimeout(searchTimer);
             input.value = '';
             filterByDescription();
             input.focus();
         })
     }
-
-    // Fixing a pyhtml-enhanced bug r.e. random whitespace
-    // appearing when displaying multi-line text
-    const descriptions = document.querySelectorAll('.desc');
-    descriptions.forEach(desc => {
-        const cleaned = desc.textContent
-            .split('\n')
-            .map(line => line.replace(/^ {10}/, ''))
-            .map(line => line.replace(/^ {8}/, ''))
-            .join('\n');
-        desc.textContent = cleaned;
-    });
 });
@@ -0,0 +1,938 @@
+import fcntl
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime as dt
+import metrics
+from ledger import (
+    Ledger, Transaction, assign_txn_ids, format_cents, ledgers_from_json,
+    new_txn_id
+)
+
+# Every mutation is expressed as an op dict so that engines can persist
+# exactly the change that was made instead of re-serialising everything:
+#   {'op': 'add_user', 'name': str, 'password': str | None}
+#   {'op': 'set_password', 'name': str, 'password': str | None}
+#   {'op': 'toggle_dark_mode', 'name': str}
+#   {'op': 'set_dark_mode', 'name': str, 'dark_mode': bool}
+#   {'op': 'add_txn', 'name': str, 'txn': dict}
+#   {'op': 'edit_txn', 'name': str, 'id': str, 'txn': dict}
+#   {'op': 'delete_txn', 'name': str, 'id': str}
+#   {'op': 'import_txns', 'txns': {name: [dict, ...]}}
+
+def txn_index(ledger: Ledger, op: dict) -> int:
+    # Ops journaled before transactions had ids address them by position
+    if 'id' in op:
+        return ledger.index_of(ledger.get(op['id']))
+    return op['index']
+
+def op_users(op: dict):
+    return op['txns'].keys() if op['op'] == 'import_txns' else [op['name']]
+
+def redacted(op: dict) -> dict:
+    # Audits record that a password was set or removed, but never its hash
+    if op.get('password') is None:
+        return op
+    return {**op, 'password': '[redacted]'}
+
+def append_audit(filename: str, entry: dict) -> None:
+    with open(filename, 'ab') as f:
+        f.write((json.dumps(redacted(entry)) + '\n').encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+def version_tag(version) -> str:
+    return hashlib.blake2b(repr(version).encode(), digest_size=8).hexdigest()
+
+def shard_name(name: str) -> str:
+    # User names can contain anything, so shards are named by a hash. Each
+    # new shard also gets a random suffix, so that a restore never writes
+    # over a shard that the current directory still names.
+    digest = hashlib.blake2b(name.encode(), digest_size=8).hexdigest()
+    return f'{digest}-{secrets.token_hex(4)}'
+
+def mark_versions(data: dict, version, names=None) -> None:
+    # Tags each ledger with the storage version at which its user last
+    # changed. A tag always stands for the same data in every worker, so
+    # pages can use it as an HTTP validator.
+    tag = version_tag(version)
+    for name in data if names is None else names:
+        data[name]['transactions'].version = tag
+
+def apply_op(data: dict, op: dict) -> None:
+    kind = op['op']
+    if kind == 'add_user':
+        data[op['name']] = {
+            'password': op['password'],
+            'dark_mode': False,
+            'transactions': Ledger()
+        }
+    elif kind == 'set_password':
+        data[op['name']]['password'] = op['password']
+    elif kind == 'toggle_dark_mode':
+        data[op['name']]['dark_mode'] = not data[op['name']]['dark_mode']
+    elif kind == 'set_dark_mode':
+        data[op['name']]['dark_mode'] = op['dark_mode']
+    elif kind == 'add_txn':
+        data[op['name']]['transactions'].insert(Transaction.from_json(op['txn']))
+    elif kind == 'edit_txn':
+        ledger = data[op['name']]['transactions']
+        ledger.replace(txn_index(ledger, op), Transaction.from_json(op['txn']))
+    elif kind == 'delete_txn':
+        ledger = data[op['name']]['transactions']
+        ledger.pop(txn_index(ledger, op))
+    elif kind == 'import_txns':
+        for name, txns in op['txns'].items():
+            data[name]['transactions'].merge([Transaction.from_json(txn) for txn in txns])
+    else:
+        raise ValueError(f'Unknown storage op: {kind}')
+
+
+def snapshot_digest(raw: bytes) -> str:
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+def json_chunks(data: dict, batch: int = 1000):
+    # The data as JSON text, with each ledger written as its transactions'
+    # to_json() list, in pieces a slice of a ledger at a time, so that large
+    # snapshots are never one huge string
+    yield '{'
+    for i, (name, user) in enumerate(data.items()):
+        yield f'{', ' if i else ''}{json.dumps(name)}: {{'
+        for j, (field, value) in enumerate(user.items()):
+            yield f'{', ' if j else ''}{json.dumps(field)}: '
+            if isinstance(value, (Ledger, list)):
+                yield '['
+                for start in range(0, len(value), batch):
+                    txns = [txn.to_json() for txn in value[start:start + batch]]
+                    yield f'{', ' if start else ''}{json.dumps(txns)[1:-1]}'
+                yield ']'
+            else:
+                yield json.dumps(value)
+        yield '}'
+    yield '}'
+
+def atomic_write(filename: str, write) -> None:
+    # Readers never see a half-written file: the new contents are written to
+    # a temporary file in the same directory, synced, then renamed over
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(
+        dir=directory, prefix=f'.{os.path.basename(filename)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, filename)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+@contextmanager
+def file_lock(filename: str, shared: bool = False):
+    # flock is honoured by every process on the machine, so this serialises
+    # writers across all gunicorn workers
+    with open(filename, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Storage(ABC):
+    # Each worker thread keeps the last parsed copy of the data and only
+    # re-reads it when the engine reports a different version. Writes patch
+    # the writing thread's copy in place, so copies are never shared: a
+    # thread behaves like a worker process of its own, at the cost of a copy
+    # each. Callers must treat whatever load() returns as read-only.
+    def __init__(self):
+        self._thread = threading.local()
+
+    @property
+    def _cache(self) -> dict | None:
+        return getattr(self._thread, 'cache', None)
+
+    @_cache.setter
+    def _cache(self, data: dict | None) -> None:
+        self._thread.cache = data
+
+    @property
+    def _cache_version(self):
+        return getattr(self._thread, 'cache_version', None)
+
+    @_cache_version.setter
+    def _cache_version(self, version) -> None:
+        self._thread.cache_version = version
+
+    @abstractmethod
+    def initialise(self, default: dict) -> None:
+        ...
+
+    @abstractmethod
+    def version(self):
+        ...
+
+    @abstractmethod
+    def read(self) -> dict:
+        ...
+
+    # Writes are serialised by each engine (a file lock, or SQLite's write
+    # lock), and an op is applied to the latest data under that lock
+    @abstractmethod
+    def save(self, data: dict) -> None:
+        ...
+
+    @abstractmethod
+    def apply(self, op: dict) -> None:
+        ...
+
+    # Migration for data written before transactions had ids
+    @abstractmethod
+    def assign_transaction_ids(self) -> None:
+        ...
+
+    def users(self) -> dict:
+        # For callers that only need names and passwords; engines that can
+        # answer without loading any ledgers override this
+        return self.load()
+
+    def load(self) -> dict:
+        # The version is taken before reading, so a concurrent write can only
+        # make the cached copy newer than its version, never older
+        version = self.version()
+        if self._cache is None or self._cache_version != version:
+            self._cache = self.read()
+            self._cache_version = version
+        return self._cache
+
+    def _set_cache(self, data: dict | None, version) -> None:
+        self._cache = data
+        self._cache_version = version
+
+
+class JsonStorage(Storage):
+    # data.json is a snapshot; each mutation is appended to data.json.journal
+    # instead of rewriting the snapshot. Journal entries record a digest of
+    # the snapshot they apply to, so once the journal has been folded into a
+    # new snapshot its entries are ignored even if compaction was interrupted.
+    # Folded entries are moved to data.json.audit, which keeps who changed
+    # what and when. Ops that carry a password hash skip the journal: they
+    # go straight into a new snapshot, and into the audit without the hash.
+    def __init__(self, filename: str, compact_threshold: int = 1_000_000):
+        super().__init__()
+        self.filename = filename
+        self.lock_file = f'{filename}.lock'
+        self.version_file = f'{filename}.version'
+        self.journal_file = f'{filename}.journal'
+        self.audit_file = f'{filename}.audit'
+        self.compact_threshold = compact_threshold
+
+    @property
+    def _snapshot_digest(self) -> str | None:
+        # Of the snapshot under this thread's cached copy
+        return getattr(self._thread, 'snapshot_digest', None)
+
+    @_snapshot_digest.setter
+    def _snapshot_digest(self, digest: str) -> None:
+        self._thread.snapshot_digest = digest
+
+    def initialise(self, default: dict) -> None:
+        with file_lock(self.lock_file):
+            if not os.path.exists(self.filename):
+                self._write_snapshot(default)
+
+    def _counter(self) -> int:
+        try:
+            with open(self.version_file) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _snapshot_version(self) -> tuple:
+        # The counter is bumped by every snapshot written through this class;
+        # the file's identity also catches data.json being replaced by hand
+        stat = os.stat(self.filename)
+        return (self._counter(), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_file)
+        except FileNotFoundError:
+            return 0
+
+    def version(self) -> tuple:
+        return (self._snapshot_version(), self._journal_size())
+
+    def read(self) -> dict:
+        with file_lock(self.lock_file, shared=True):
+            with open(self.filename, 'rb') as f:
+                raw = f.read()
+            metrics.count('tally_storage_bytes_total', len(raw), file='snapshot', direction='read')
+            with metrics.timed('parse'):
+                data = ledgers_from_json(json.loads(raw))
+            offset = self._replay(data, snapshot_digest(raw), 0)
+            mark_versions(data, (self._snapshot_version(), offset))
+            return data
+
+    def load(self) -> dict:
+        if self._cache is not None and self._cache_version == self.version():
+            return self._cache
+        with file_lock(self.lock_file, shared=True):
+            return self._refresh()
+
+    def _refresh(self) -> dict:
+        # Must be called with the lock held. Only journal entries appended
+        # since the last refresh are replayed onto the cached copy.
+        snapshot_version = self._snapshot_version()
+        if self._cache is None or self._cache_version[0] != snapshot_version:
+            with open(self.filename, 'rb') as f:
+                raw = f.read()
+            metrics.count(
+                'tally_storage_bytes_total', len(raw), file='snapshot', direction='read')
+            with metrics.timed('parse'):
+                self._cache = ledgers_from_json(json.loads(raw))
+            self._snapshot_digest = snapshot_digest(raw)
+            offset = 0
+            changed = None
+        else:
+            offset = self._cache_version[1]
+            changed = set()
+        try:
+            offset = self._replay(self._cache, self._snapshot_digest, offset, changed)
+        except BaseException:
+            self._cache = None
+            raise
+        self._cache_version = (snapshot_version, offset)
+        mark_versions(self._cache, self._cache_version, changed)
+        return self._cache
+
+    def _replay(self, data: dict, digest: str, offset: int, changed: set = None) -> int:
+        # Adds the users whose data changed to changed, if given
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return offset
+        start = offset
+        with f:
+            f.seek(offset)
+            for line in f:
+                # A line without a newline is an append cut short by a crash
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                entry = json.loads(line)
+                if entry['base'] == digest:
+                    apply_op(data, entry)
+                    if changed is not None:
+                        changed.update(op_users(entry))
+        metrics.count('tally_storage_bytes_total', offset - start, file='journal', direction='read')
+        return offset
+
+    def _write_snapshot(self, data: dict) -> None:
+        # The data is replaced before the counter so that a reader can only
+        # ever pair a version with data at least that new
+        data = ledgers_from_json(data)
+        assign_txn_ids(data)
+        digest = hashlib.blake2b(digest_size=8)
+        def write(f):
+            for chunk in json_chunks(data):
+                raw = chunk.encode()
+                f.write(chunk)
+                digest.update(raw)
+                metrics.count(
+                    'tally_storage_bytes_total', len(raw), file='snapshot', direction='written')
+        counter = self._counter() + 1
+        atomic_write(self.filename, write)
+        atomic_write(self.version_file, lambda f: f.write(str(counter)))
+        self._snapshot_digest = digest.hexdigest()
+        self._archive_journal()
+        version = (self._snapshot_version(), 0)
+        mark_versions(data, version)
+        self._set_cache(data, version)
+
+    def _archive_journal(self) -> None:
+        try:
+            with open(self.journal_file, 'rb') as f:
+                folded = f.read()
+        except FileNotFoundError:
+            return
+        with open(self.audit_file, 'ab') as f:
+            f.write(folded)
+            f.flush()
+            os.fsync(f.fileno())
+        os.truncate(self.journal_file, 0)
+
+    def discard(self, audit_file: str) -> None:
+        # Deletes the store and every file beside it, after appending its
+        # audit, with the journal folded in, to audit_file. Anyone still
+        # waiting on the lock then finds no snapshot and gets FileNotFoundError.
+        with file_lock(self.lock_file):
+            self._archive_journal()
+            try:
+                with open(self.audit_file, 'rb') as f:
+                    history = f.read()
+            except FileNotFoundError:
+                history = b''
+            with open(audit_file, 'ab') as f:
+                f.write(history)
+                f.flush()
+                os.fsync(f.fileno())
+            for filename in (
+                self.filename, self.version_file, self.journal_file, self.audit_file,
+                self.lock_file
+            ):
+                try:
+                    os.unlink(filename)
+                except FileNotFoundError:
+                    pass
+            self._set_cache(None, None)
+
+    def save(self, data: dict) -> None:
+        with file_lock(self.lock_file):
+            self._write_snapshot(data)
+
+    def assign_transaction_ids(self) -> None:
+        with file_lock(self.lock_file):
+            data = self._refresh()
+            if assign_txn_ids(data):
+                self._write_snapshot(data)
+
+    def apply(self, op: dict) -> None:
+        with file_lock(self.lock_file):
+            # Holding the lock means the refreshed copy is the latest data
+            data = self._refresh()
+            snapshot_version, offset = self._cache_version
+            entry = {
+                'base': self._snapshot_digest,
+                'at': dt.now().isoformat(timespec='seconds'),
+                **op
+            }
+            if 'password' in op:
+                try:
+                    apply_op(data, op)
+                    self._write_snapshot(data)
+                except BaseException:
+                    self._set_cache(None, None)
+                    raise
+                append_audit(self.audit_file, entry)
+                return
+            line = (json.dumps(entry) + '\n').encode()
+            try:
+                apply_op(data, op)
+                with open(self.journal_file, 'ab') as f:
+                    # Drop any partial line left behind by a crashed writer
+                    if f.tell() != offset:
+                        f.truncate(offset)
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except BaseException:
+                self._set_cache(None, None)
+                raise
+            metrics.count('tally_storage_bytes_total', len(line), file='journal', direction='written')
+            mark_versions(data, (snapshot_version, offset + len(line)), op_users(op))
+            self._set_cache(data, (snapshot_version, offset + len(line)))
+            if offset + len(line) >= self.compact_threshold:
+                self._write_snapshot(data)
+
+
+class ShardedData(Mapping):
+    # The user -> data mapping returned by ShardedStorage.load(). Names come
+    # from the directory; a user's shard is only loaded when their data is
+    # looked up.
+    def __init__(self, storage: 'ShardedStorage', directory: dict):
+        self._storage = storage
+        self._directory = directory
+        self._users = {}
+
+    def __getitem__(self, name: str) -> dict:
+        if name not in self._users:
+            user = self._storage.load_user(name, self._directory[name]['shard'])
+            self._users[name] = {'password': self._directory[name]['password'], **user}
+        return self._users[name]
+
+    def __iter__(self):
+        return iter(self._directory)
+
+    def __len__(self) -> int:
+        return len(self._directory)
+
+    def __contains__(self, name) -> bool:
+        return name in self._directory
+
+
+class ShardedStorage(Storage):
+    # Each user's dark mode setting and ledger live in a shard of their own,
+    # a JsonStorage under shards/ with its own lock, journal and cache, so
+    # writes for different users never wait on each other and a request
+    # only reads the shards it looks at. users.json is the directory of
+    # names, passwords and shards; only adding users and changing passwords
+    # rewrite it, and those changes are appended to users.json.audit.
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = root
+        self.filename = os.path.join(root, 'users.json')
+        self.lock_file = f'{self.filename}.lock'
+        self.audit_file = f'{self.filename}.audit'
+        self.shard_dir = os.path.join(root, 'shards')
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+
+    def shard(self, shard_id: str) -> JsonStorage:
+        with self._shards_lock:
+            if shard_id not in self._shards:
+                self._shards[shard_id] = JsonStorage(
+                    os.path.join(self.shard_dir, f'{shard_id}.json'))
+            return self._shards[shard_id]
+
+    def _user_shard(self, name: str) -> JsonStorage:
+        # Raises KeyError for unknown users, like apply_op
+        return self.shard(self.users()[name]['shard'])
+
+    def load_user(self, name: str, shard_id: str) -> dict:
+        try:
+            return self.shard(shard_id).load()[name]
+        except FileNotFoundError:
+            # A restore has discarded the shard since the directory was read
+            return self._user_shard(name).load()[name]
+
+    def _apply_to_user(self, name: str, op: dict) -> None:
+        try:
+            self._user_shard(name).apply(op)
+        except FileNotFoundError:
+            # As in load_user(); the write goes to the restored data
+            self._user_shard(name).apply(op)
+
+    def version(self) -> tuple:
+        # Only the directory has a version of its own; each shard has another
+        stat = os.stat(self.filename)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _read_directory(self) -> dict:
+        with open(self.filename, 'rb') as f:
+            raw = f.read()
+        metrics.count('tally_storage_bytes_total', len(raw), file='directory', direction='read')
+        with metrics.timed('parse'):
+            return json.loads(raw)
+
+    def _write_directory(self, directory: dict) -> None:
+        raw = json.dumps(directory)
+        atomic_write(self.filename, lambda f: f.write(raw))
+        metrics.count(
+            'tally_storage_bytes_total', len(raw.encode()), file='directory', direction='written')
+        self._set_cache(directory, self.version())
+
+    def users(self) -> dict:
+        if self._cache is not None and self._cache_version == self.version():
+            return self._cache
+        with file_lock(self.lock_file, shared=True):
+            self._cache = self._read_directory()
+            self._cache_version = self.version()
+            return self._cache
+
+    def load(self) -> ShardedData:
+        return ShardedData(self, self.users())
+
+    def read(self) -> dict:
+        # A restore holds the directory lock until the old shards are gone,
+        # so this sees either all of the old data or all of the new
+        with file_lock(self.lock_file, shared=True):
+            return dict(ShardedData(self, self._read_directory()))
+
+    def _replace(self, data: dict) -> None:
+        # Must be called with the directory lock held. The data goes into new
+        # shards, and renaming the new directory into place switches every
+        # user over at once; until then readers see only the old data, and a
+        # crash leaves only unused new shards. The old shards are discarded
+        # afterwards, their audits moving into the directory's.
+        data = ledgers_from_json(data)
+        try:
+            old = self._read_directory()
+        except FileNotFoundError:
+            old = {}
+        directory = {}
+        for name, user in data.items():
+            shard_id = shard_name(name)
+            self.shard(shard_id).save(
+                {name: {'dark_mode': user['dark_mode'], 'transactions': user['transactions']}})
+            directory[name] = {'password': user['password'], 'shard': shard_id}
+        self._write_directory(directory)
+        for entry in old.values():
+            self.shard(entry['shard']).discard(self.audit_file)
+            with self._shards_lock:
+                self._shards.pop(entry['shard'], None)
+
+    def initialise(self, default: dict) -> None:
+        with file_lock(self.lock_file):
+            if not os.path.exists(self.filename):
+                self._replace(default)
+
+    def save(self, data: dict) -> None:
+        with file_lock(self.lock_file):
+            self._replace(data)
+
+    def assign_transaction_ids(self) -> None:
+        # Shards are only ever written by JsonStorage, which assigns ids
+        pass
+
+    def apply(self, op: dict) -> None:
+        kind = op['op']
+        if kind in ('add_user', 'set_password'):
+            with file_lock(self.lock_file):
+                directory = self._read_directory()
+                if kind == 'add_user':
+                    shard_id = shard_name(op['name'])
+                    self.shard(shard_id).save(
+                        {op['name']: {'dark_mode': False, 'transactions': []}})
+                    directory[op['name']] = {'password': op['password'], 'shard': shard_id}
+                else:
+                    directory[op['name']]['password'] = op['password']
+                append_audit(
+                    self.audit_file, {'at': dt.now().isoformat(timespec='seconds'), **op})
+                self._write_directory(directory)
+            return
+        if kind == 'import_txns':
+            # One journal entry per user. Users are not updated atomically
+            # together, but read_import has already checked every row.
+            # Unknown users fail before anything is written
+            for name in op['txns']:
+                self._user_shard(name)
+            for name, txns in op['txns'].items():
+                self._apply_to_user(name, {**op, 'txns': {name: txns}})
+        else:
+            self._apply_to_user(op['name'], op)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    password TEXT,
+    dark_mode INTEGER NOT NULL DEFAULT 0,
+    -- The meta version at which the user's data last changed
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL REFERENCES users (name) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    description TEXT NOT NULL,
+    uid TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_by_user
+    ON transactions (user, date DESC, seq DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    version INTEGER NOT NULL
+);
+INSERT INTO meta (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM meta);
+'''
+
+# Ledgers are listed newest first; among equal dates the most recently
+# inserted transaction comes first, which is what insert_transaction does
+TXN_ORDER = 'ORDER BY date DESC, seq DESC'
+
+
+class SqliteStorage(Storage):
+    def __init__(self, filename: str):
+        super().__init__()
+        self.filename = filename
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Transactions are managed explicitly by _transaction()
+            conn = sqlite3.connect(self.filename, isolation_level=None, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._migrate_schema()
+        return conn
+
+    def _migrate_schema(self) -> None:
+        with self._transaction(write=True) as conn:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(transactions)')}
+            if 'uid' not in columns:
+                conn.execute('ALTER TABLE transactions ADD COLUMN uid TEXT')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+            if 'version' not in columns:
+                conn.execute('ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            conn.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS transactions_by_uid ON transactions (uid)')
+
+    def initialise(self, default: dict) -> None:
+        # Only the first worker to start writes the initial data
+        self._save(default, only_if_new=True)
+
+    @contextmanager
+    def _transaction(self, write: bool = False):
+        # BEGIN IMMEDIATE takes the write lock up front so that the reads a
+        # write depends on cannot be invalidated by another worker
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def version(self) -> int:
+        return self.conn.execute('SELECT version FROM meta').fetchone()[0]
+
+    def _bump_version(self, conn: sqlite3.Connection) -> tuple[int, int]:
+        old_version = conn.execute('SELECT version FROM meta').fetchone()[0]
+        conn.execute('UPDATE meta SET version = ?', (old_version + 1,))
+        return old_version, old_version + 1
+
+    def _read(self) -> tuple[dict, int]:
+        # The version comes from the same read transaction as the rows, so
+        # it is exactly the version the data is at
+        with self._transaction() as conn:
+            meta_version = conn.execute('SELECT version FROM meta').fetchone()[0]
+            users = conn.execute(
+                'SELECT name, password, dark_mode, version FROM users ORDER BY rowid'
+            ).fetchall()
+            data = {}
+            for name, password, dark_mode, version in users:
+                data[name] = {
+                    'password': password,
+                    'dark_mode': bool(dark_mode),
+                    'transactions': Ledger.from_json(self._transactions(conn, name))
+                }
+                data[name]['transactions'].version = version_tag(version)
+        return data, meta_version
+
+    def read(self) -> dict:
+        return self._read()[0]
+
+    def load(self) -> dict:
+        # Unlike Storage.load(), the cached copy must never be newer than its
+        # version: apply() patches it in place when the version matches, and
+        # would otherwise apply an op the copy already has
+        version = self.version()
+        if self._cache is None or self._cache_version != version:
+            self._cache, self._cache_version = self._read()
+        return self._cache
+
+    def users(self) -> dict:
+        # The cached copy when it is current, otherwise only the users table
+        if self._cache is not None and self._cache_version == self.version():
+            return self._cache
+        with self._transaction() as conn:
+            return {
+                name: {'password': password}
+                for name, password in conn.execute(
+                    'SELECT name, password FROM users ORDER BY rowid')
+            }
+
+    def _transactions(self, conn: sqlite3.Connection, name: str) -> list[dict]:
+        txns = conn.execute(
+            'SELECT type, date, amount, description, uid FROM transactions '
+            f'WHERE user = ? {TXN_ORDER}', (name,)
+        )
+        return [
+            {'type': type_, 'date': date, 'amount': amount, 'desc': desc, 'id': uid}
+            for type_, date, amount, desc, uid in txns
+        ]
+
+    def save(self, data: dict) -> None:
+        self._save(data)
+
+    def _save(self, data: dict, only_if_new: bool = False) -> bool:
+        # Returns whether the data was written; with only_if_new, a database
+        # that has ever been written to (version above 0) is left alone
+        data = ledgers_from_json(data)
+        assign_txn_ids(data)
+        with self._transaction(write=True) as conn:
+            if only_if_new and conn.execute('SELECT version FROM meta').fetchone()[0]:
+                return False
+            _, version = self._bump_version(conn)
+            conn.execute('DELETE FROM transactions')
+            conn.execute('DELETE FROM users')
+            for name, user in data.items():
+                conn.execute(
+                    'INSERT INTO users (name, password, dark_mode, version) '
+                    'VALUES (?, ?, ?, ?)',
+                    (name, user['password'], bool(user['dark_mode']), version)
+                )
+                txns = user['transactions']
+                conn.executemany(
+                    'INSERT INTO transactions '
+                    '(user, seq, type, date, amount, description, uid) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        (name, len(txns) - i, txn.type.value, txn.date,
+                         format_cents(txn.cents), txn.desc, txn.id)
+                        for i, txn in enumerate(txns)
+                    )
+                )
+        mark_versions(data, version)
+        self._set_cache(data, version)
+        return True
+
+    def assign_transaction_ids(self) -> None:
+        with self._transaction(write=True) as conn:
+            rows = conn.execute('SELECT id FROM transactions WHERE uid IS NULL').fetchall()
+            if not rows:
+                return
+            conn.executemany(
+                'UPDATE transactions SET uid = ? WHERE id = ?',
+                [(new_txn_id(), row_id) for (row_id,) in rows]
+            )
+            _, version = self._bump_version(conn)
+            conn.execute('UPDATE users SET version = ?', (version,))
+        self._set_cache(None, None)
+
+    def apply(self, op: dict) -> None:
+        handler = getattr(self, f'_{op['op']}', None)
+        if handler is None:
+            raise ValueError(f'Unknown storage op: {op['op']}')
+        with self._transaction(write=True) as conn:
+            handler(conn, op)
+            old_version, version = self._bump_version(conn)
+            conn.executemany(
+                'UPDATE users SET version = ? WHERE name = ?',
+                [(version, name) for name in op_users(op)]
+            )
+        # Patch the cached copy in place when nobody else wrote in between
+        if self._cache is not None and self._cache_version == old_version:
+            apply_op(self._cache, op)
+            mark_versions(self._cache, version, op_users(op))
+            self._cache_version = version
+        else:
+            self._cache = None
+
+    def _add_user(self, conn: sqlite3.Connection, op: dict) -> None:
+        conn.execute(
+            'INSERT INTO users (name, password, dark_mode) VALUES (?, ?, 0)',
+            (op['name'], op['password'])
+        )
+
+    def _set_password(self, conn: sqlite3.Connection, op: dict) -> None:
+        conn.execute(
+            'UPDATE users SET password = ? WHERE name = ?',
+            (op['password'], op['name'])
+        )
+
+    def _toggle_dark_mode(self, conn: sqlite3.Connection, op: dict) -> None:
+        conn.execute(
+            'UPDATE users SET dark_mode = NOT dark_mode WHERE name = ?',
+            (op['name'],)
+        )
+
+    def _set_dark_mode(self, conn: sqlite3.Connection, op: dict) -> None:
+        conn.execute(
+            'UPDATE users SET dark_mode = ? WHERE name = ?',
+            (bool(op['dark_mode']), op['name'])
+        )
+
+    def _next_seq(self, conn: sqlite3.Connection, name: str) -> int:
+        return conn.execute(
+            'SELECT COALESCE(MAX(seq), 0) + 1 FROM transactions WHERE user = ?',
+            (name,)
+        ).fetchone()[0]
+
+    def _txn_row(self, conn: sqlite3.Connection, op: dict) -> tuple:
+        # Ops journaled before transactions had ids address them by position
+        if 'id' in op:
+            row = conn.execute(
+                'SELECT id, date FROM transactions WHERE user = ? AND uid = ?',
+                (op['name'], op['id'])
+            ).fetchone()
+        else:
+            row = conn.execute(
+                f'SELECT id, date FROM transactions WHERE user = ? {TXN_ORDER} '
+                'LIMIT 1 OFFSET ?', (op['name'], op['index'])
+            ).fetchone()
+        if row is None:
+            raise KeyError(f'No such transaction for {op['name']}')
+        return row
+
+    def _add_txn(self, conn: sqlite3.Connection, op: dict) -> None:
+        txn = Transaction.from_json(op['txn']).to_json()
+        conn.execute(
+            'INSERT INTO transactions (user, seq, type, date, amount, description, uid) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (op['name'], self._next_seq(conn, op['name']), txn['type'],
+             txn['date'], txn['amount'], txn['desc'], txn.get('id'))
+        )
+
+    def _edit_txn(self, conn: sqlite3.Connection, op: dict) -> None:
+        txn = Transaction.from_json(op['txn']).to_json()
+        txn_id, old_date = self._txn_row(conn, op)
+        conn.execute(
+            'UPDATE transactions SET type = ?, date = ?, amount = ?, description = ?, '
+            'uid = COALESCE(?, uid) WHERE id = ?',
+            (txn['type'], txn['date'], txn['amount'], txn['desc'], txn.get('id'), txn_id)
+        )
+        # A changed date moves the transaction like a fresh insert would
+        if txn['date'] != old_date:
+            conn.execute(
+                'UPDATE transactions SET seq = ? WHERE id = ?',
+                (self._next_seq(conn, op['name']), txn_id)
+            )
+
+    def _delete_txn(self, conn: sqlite3.Connection, op: dict) -> None:
+        txn_id, _ = self._txn_row(conn, op)
+        conn.execute('DELETE FROM transactions WHERE id = ?', (txn_id,))
+
+    def _import_txns(self, conn: sqlite3.Connection, op: dict) -> None:
+        # Rows are numbered as if they had been added one at a time
+        for name, txns in op['txns'].items():
+            seq = self._next_seq(conn, name)
+            conn.executemany(
+                'INSERT INTO transactions (user, seq, type, date, amount, description, uid) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (name, seq + i, txn.type.value, txn.date, format_cents(txn.cents),
+                     txn.desc, txn.id)
+                    for i, txn in enumerate(map(Transaction.from_json, txns))
+                )
+            )
+
+
+def migrate_json_to_sqlite(json_file: str, db_file: str) -> None:
+    # With the journal replayed, not just the snapshot
+    data = JsonStorage(json_file).read()
+    # Never overwrites a database that already has data
+    if not SqliteStorage(db_file)._save(data, only_if_new=True):
+        sys.exit(f'{db_file} already has data')
+
+ENGINES = {
+    'json': JsonStorage,
+    'sqlite': SqliteStorage,
+    'sharded': ShardedStorage
+}
+# Where each engine keeps its data unless DATA_FILE says otherwise
+DATA_FILES = {'json': 'data.json', 'sqlite': 'data.db', 'sharded': 'data'}
+
+def get_storage(engine: str, filename: str) -> Storage:
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown storage engine: {engine}')
+    return ENGINES[engine](filename)
+
+if __name__ == '__main__':
+    # One-shot migration: python storage.py data.json data.db
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python storage.py <data.json> <data.db>')
+    migrate_json_to_sqlite(sys.argv[1], sys.argv[2])
@@ -0,0 +1,29 @@
+import importlib
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage import DATA_FILES
+
+@pytest.fixture(params=list(DATA_FILES))
+def engine(request) -> str:
+    return request.param
+
+@pytest.fixture
+def load_main(engine, tmp_path, monkeypatch):
+    # main picks its engine and data file, and seeds the data, on import.
+    # Each call imports it afresh, with the data in its default place under
+    # tmp_path; anything put there first is what it starts from.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('STORAGE_ENGINE', engine)
+    monkeypatch.delenv('DATA_FILE', raising=False)
+    def load():
+        if 'main' in sys.modules:
+            return importlib.reload(sys.modules['main'])
+        return importlib.import_module('main')
+    return load
+
+@pytest.fixture
+def client(load_main):
+    return load_main().app.test_client()
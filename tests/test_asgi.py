@@ -0,0 +1,81 @@
+import asyncio
+import importlib
+import json
+from urllib.parse import urlencode
+from storage import get_storage
+
+USERS = ['Amy Lee', 'Ben Ng', 'Cat Roe']
+SEEDED, ADDS, DELETES, READS = 1000, 50, 50, 50
+
+async def request(app, method: str, path: str, cookie: str = '', body: bytes = b'',
+                  content_type: str | None = None) -> tuple[int, list[str]]:
+    path, _, query = path.partition('?')
+    headers = [
+        (b'host', b'localhost'), (b'cookie', cookie.encode()),
+        (b'content-length', str(len(body)).encode())
+    ]
+    if content_type:
+        headers.append((b'content-type', content_type.encode()))
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'root_path': '',
+        'query_string': query.encode(), 'http_version': '1.1', 'scheme': 'http',
+        'headers': headers, 'server': ('localhost', 80), 'client': ('127.0.0.1', 1)
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+    sent = []
+    async def send(message):
+        sent.append(message)
+    await app(scope, receive, send)
+    cookies = [
+        value.decode().split(';')[0] for name, value in sent[0]['headers']
+        if name == b'set-cookie'
+    ]
+    return sent[0]['status'], cookies
+
+async def burst(app) -> list[tuple[str, int]]:
+    # Concurrent adds, deletes and page reads for every user at once
+    _, cookies = await request(
+        app, 'POST', '/', body=urlencode({'name': 'Ethan Ryoo', 'password': ''}).encode(),
+        content_type='application/x-www-form-urlencoded')
+    cookie = cookies[0]
+    txn = json.dumps({'type': 'debt', 'date': '2025-01-01', 'amount': '2.50', 'desc': 'x'})
+    jobs = []
+    for name in USERS:
+        for _ in range(ADDS):
+            jobs.append(('add', request(
+                app, 'POST', f'/api/users/{name}/transactions', cookie, txn.encode(),
+                'application/json')))
+        for i in range(DELETES):
+            jobs.append(('delete', request(
+                app, 'DELETE', f'/api/users/{name}/transactions/{name[0]}{i:015d}', cookie)))
+        for i in range(READS):
+            path = [
+                f'/api/users/{name}/transactions', f'/edit/{name}',
+                f'/statistics?user={name}', '/home', '/export'
+            ][i % 5]
+            jobs.append(('read', request(app, 'GET', path, cookie)))
+    results = await asyncio.gather(*(job for _, job in jobs))
+    return [(kind, status) for (kind, _), (status, _) in zip(jobs, results)]
+
+def test_concurrent_requests(load_main, engine):
+    main = load_main()
+    main.storage.save({
+        'Ethan Ryoo': {'password': None, 'dark_mode': False, 'transactions': []},
+        **{
+            name: {'password': None, 'dark_mode': False, 'transactions': [
+                {'type': 'debt', 'date': '2024-01-01', 'amount': '1.00',
+                 'desc': f'Seeded {i}', 'id': f'{name[0]}{i:015d}'}
+                for i in range(SEEDED)
+            ]}
+            for name in USERS
+        }
+    })
+    # asgi wraps whichever main was imported last
+    asgi = importlib.reload(importlib.import_module('asgi'))
+    statuses = asyncio.run(burst(asgi.app))
+    expected = {'add': 201, 'delete': 200, 'read': 200}
+    assert [(kind, status) for kind, status in statuses if status != expected[kind]] == []
+    fresh = get_storage(engine, main.DATA_FILE).read()
+    assert {len(fresh[name]['transactions']) for name in USERS} == {SEEDED + ADDS - DELETES}
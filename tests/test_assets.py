@@ -0,0 +1,25 @@
+import os
+from assets import AssetPipeline, minify_css
+
+STATIC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+def test_unknown_names_are_not_built():
+    pipeline = AssetPipeline(STATIC)
+    url = pipeline.bundle(['main', 'history'])
+    built = dict(pipeline.assets)
+    assert pipeline.get(url.removeprefix('/assets/')) is not None
+    for name in [
+        'styles/main+main+main.0000000000000000.css',
+        url.removeprefix('/assets/').replace('main+history', 'history+main'),
+        'styles/main.css', '../main.py'
+    ]:
+        assert pipeline.get(name) is None
+    assert pipeline.assets == built
+
+def test_minify_css_keeps_selectors_and_queries():
+    css = '/* note */\nnav > a:hover,\n.x :focus {\n    width: calc(100% - 5px);\n}\n' \
+        '@media (max-width: 620px) {\n    p { margin: 0; }\n}\n'
+    assert minify_css(css) == (
+        'nav>a:hover,.x :focus{width:calc(100% - 5px)}'
+        '@media (max-width:620px){p{margin:0}}'
+    )
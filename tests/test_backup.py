@@ -0,0 +1,34 @@
+import io
+import pytest
+from backup import InvalidBackup, read_import
+from ledger import Ledger, Transaction, TxnType
+
+HEADER = 'user,type,date,amount,desc,id\n'
+
+def import_csv(text: str, data: dict) -> dict:
+    return read_import(io.BytesIO(text.encode()), 'csv', data)
+
+def users(**ledgers: Ledger) -> dict:
+    return {
+        name: {'password': None, 'dark_mode': False, 'transactions': txns}
+        for name, txns in ledgers.items()
+    }
+
+def test_csv_row_with_too_many_fields_is_rejected():
+    text = 'user,type,date,amount,desc\nAmy,debt,2025-01-01,1.00,Lunch,extra\n'
+    with pytest.raises(InvalidBackup, match='line 2: too many fields'):
+        import_csv(text, users(Amy=Ledger()))
+
+def test_import_rejects_ids_already_stored_or_repeated():
+    stored = Ledger([Transaction(TxnType('debt'), 739252, 100, 'Lunch', 'a1')])
+    data = users(Amy=Ledger(), Ben=stored)
+    assert import_csv(HEADER + 'Amy,debt,2025-01-01,1.00,Lunch,b1\n', data) == {
+        'Amy': [{'type': 'debt', 'date': '2025-01-01', 'amount': '1.00',
+                 'desc': 'Lunch', 'id': 'b1'}]
+    }
+    with pytest.raises(InvalidBackup, match='line 2: duplicate id a1'):
+        import_csv(HEADER + 'Amy,debt,2025-01-01,1.00,Lunch,a1\n', data)
+    with pytest.raises(InvalidBackup, match='line 3: duplicate id b1'):
+        import_csv(
+            HEADER + 'Amy,debt,2025-01-01,1.00,Lunch,b1\nBen,debt,2025-01-01,1.00,Lunch,b1\n',
+            data)
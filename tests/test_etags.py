@@ -0,0 +1,50 @@
+import pytest
+
+USERS = ['Ethan Ryoo', 'Amy Lee', 'Ben Ng']
+
+@pytest.fixture
+def tally(load_main):
+    main = load_main()
+    main.storage.save({
+        name: {'password': None, 'dark_mode': False, 'transactions': [
+            {'type': 'debt', 'date': '2025-01-01', 'amount': '1.00', 'desc': 'Lunch'}
+        ]}
+        for name in USERS
+    })
+    return main
+
+def sign_in(main, name: str):
+    client = main.app.test_client()
+    client.post('/', data={'name': name, 'password': ''})
+    return client
+
+def add_txn(master, user: str) -> None:
+    response = master.post(f'/api/users/{user}/transactions', json={
+        'type': 'debt', 'date': '2025-02-01', 'amount': '2.00', 'desc': 'Dinner'
+    })
+    assert response.status_code == 201
+
+def revalidate(client, path: str, etag: str) -> int:
+    return client.get(path, headers={'If-None-Match': etag}).status_code
+
+@pytest.mark.parametrize('path', ['/home', '/history', '/statistics'])
+def test_etag_changes_with_the_users_data(tally, path):
+    amy, master = sign_in(tally, 'Amy Lee'), sign_in(tally, 'Ethan Ryoo')
+    etag = amy.get(path).headers['ETag']
+    assert revalidate(amy, path, etag) == 304
+    add_txn(master, 'Ben Ng')
+    assert revalidate(amy, path, etag) == 304
+    add_txn(master, 'Amy Lee')
+    assert revalidate(amy, path, etag) == 200
+    new_etag = amy.get(path).headers['ETag']
+    assert new_etag != etag
+    assert revalidate(amy, path, new_etag) == 304
+    amy.post('/toggle_dark_mode')
+    assert revalidate(amy, path, new_etag) == 200
+
+def test_master_statistics_change_with_any_user(tally):
+    master = sign_in(tally, 'Ethan Ryoo')
+    etag = master.get('/statistics').headers['ETag']
+    assert revalidate(master, '/statistics', etag) == 304
+    add_txn(master, 'Ben Ng')
+    assert revalidate(master, '/statistics', etag) == 200
@@ -0,0 +1,53 @@
+import io
+import pytest
+
+@pytest.fixture
+def master(load_main):
+    main = load_main()
+    main.storage.save({
+        'Ethan Ryoo': {'password': None, 'dark_mode': False, 'transactions': []},
+        'Amy Lee': {'password': None, 'dark_mode': False, 'transactions': []},
+    })
+    client = main.app.test_client()
+    client.post('/', data={'name': 'Ethan Ryoo', 'password': ''})
+    return main, client
+
+@pytest.mark.parametrize('amount', ['', 'lots', '-1.00'])
+def test_master_form_rejects_a_bad_amount(master, amount):
+    main, client = master
+    response = client.post('/master', data={
+        'transaction_submit': '', 'user': 'Amy Lee', 'type': 'debt',
+        'date': '2025-01-01', 'amount': amount, 'desc': ''
+    })
+    assert response.status_code == 400
+    assert len(main.storage.read()['Amy Lee']['transactions']) == 0
+
+def test_master_form_adds_a_transaction(master):
+    main, client = master
+    response = client.post('/master', data={
+        'transaction_submit': '', 'user': 'Amy Lee', 'type': 'debt',
+        'date': '2025-01-01', 'amount': '2.50', 'desc': ''
+    })
+    assert response.status_code == 200
+    assert len(main.storage.read()['Amy Lee']['transactions']) == 1
+
+def test_uploads_are_capped(load_main, monkeypatch):
+    monkeypatch.setenv('MAX_UPLOAD_MB', '1')
+    main = load_main()
+    client = main.app.test_client()
+    client.post('/', data={'name': 'Ethan Ryoo', 'password': ''})
+    response = client.post('/master', data={
+        'data_file_submit': '', 'data_file': (io.BytesIO(b' ' * 2 * 1024 * 1024), 'data.json')
+    })
+    assert response.status_code == 413
+
+@pytest.mark.parametrize('query', ['', '   '])
+def test_blank_search_finds_nothing(master, query):
+    main, client = master
+    client.post('/api/users/Ethan Ryoo/transactions', json={
+        'type': 'debt', 'date': '2025-01-01', 'amount': '1.00', 'desc': 'Lunch'
+    })
+    assert client.get('/search', query_string={'q': 'lunch'}).json['count'] == 1
+    assert client.get('/search', query_string={'q': query}).json == {
+        'query': '', 'count': 0, 'results': []
+    }
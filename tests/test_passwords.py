@@ -0,0 +1,28 @@
+import threading
+import time
+import pytest
+import passwords
+from passwords import PasswordBusy
+
+def test_timed_out_checks_keep_their_slot_until_they_finish(monkeypatch, request):
+    monkeypatch.setattr(passwords, 'PASSWORD_TIMEOUT', 0.01)
+    release = threading.Event()
+    # Lets the blocked checks finish even if an assertion fails first
+    request.addfinalizer(release.set)
+    for _ in range(passwords.PASSWORD_THREADS + passwords.PASSWORD_QUEUE):
+        with pytest.raises(PasswordBusy, match='Timed out'):
+            passwords._run(release.wait)
+    # Every slot is still held by work that hasn't finished
+    with pytest.raises(PasswordBusy, match='Too many'):
+        passwords._run(lambda: True)
+    release.set()
+    # The pool threads free the slots as the work finishes
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            assert passwords._run(lambda: True)
+            break
+        except PasswordBusy:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
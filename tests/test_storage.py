@@ -0,0 +1,231 @@
+import multiprocessing
+import os
+import threading
+import time
+import pytest
+from ledger import new_txn_id
+from storage import DATA_FILES, JsonStorage, get_storage, migrate_json_to_sqlite
+
+USER = 'Amy Lee'
+OTHER = 'Ben Ng'
+WRITERS, WRITES = 4, 60
+
+def txn(i: int) -> dict:
+    return {
+        'type': 'debt', 'date': '2025-01-01', 'amount': '1.00',
+        'desc': f'Transaction {i}', 'id': new_txn_id()
+    }
+
+def test_sqlite_cache_matches_database_under_concurrent_reads(tmp_path):
+    # A read that overlaps a write must not leave the cache labelled with an
+    # older version than its rows, or apply() patches the write in twice
+    filename = str(tmp_path / 'data.db')
+    storage = get_storage('sqlite', filename)
+    storage.initialise({USER: {'password': None, 'dark_mode': False, 'transactions': []}})
+    # Widens the gap between a reader checking the version and reading
+    version = storage.version
+    def slow_version():
+        current = version()
+        time.sleep(0.001)
+        return current
+    storage.version = slow_version
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                len(storage.load()[USER]['transactions'])
+            except Exception as e:
+                errors.append(e)
+
+    def write(target, start: int):
+        for i in range(start, start + 100):
+            target.apply({'op': 'add_txn', 'name': USER, 'txn': txn(i)})
+
+    # Writes from another worker leave this worker's cache stale, so its
+    # readers re-read while its own writes are being committed
+    other = get_storage('sqlite', filename)
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    writers = [
+        threading.Thread(target=write, args=(other if i % 2 else storage, i * 100))
+        for i in range(4)
+    ]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+    stored = get_storage('sqlite', filename).read()[USER]['transactions']
+    assert len(stored) == 400
+    assert len(storage.load()[USER]['transactions']) == 400
+
+def open_storage(engine: str, filename: str):
+    if engine == 'json':
+        # Small enough that the writers compact the journal many times over
+        return JsonStorage(filename, compact_threshold=4096)
+    return get_storage(engine, filename)
+
+def write_many(engine: str, filename: str, worker: int) -> None:
+    # Each worker process opens the data itself, as a server worker does
+    storage = open_storage(engine, filename)
+    storage.apply({'op': 'add_user', 'name': f'Worker {worker}', 'password': None})
+    for i in range(WRITES):
+        storage.apply({'op': 'add_txn', 'name': (USER, OTHER)[i % 2], 'txn': txn(i)})
+        storage.apply({'op': 'toggle_dark_mode', 'name': USER})
+
+def test_concurrent_writer_processes_lose_no_updates(engine, tmp_path):
+    filename = str(tmp_path / DATA_FILES[engine])
+    open_storage(engine, filename).initialise({
+        name: {'password': None, 'dark_mode': False, 'transactions': []}
+        for name in (USER, OTHER)
+    })
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=write_many, args=(engine, filename, worker))
+        for worker in range(WRITERS)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * WRITERS
+
+    data = open_storage(engine, filename).read()
+    assert set(data) == {USER, OTHER} | {f'Worker {worker}' for worker in range(WRITERS)}
+    for name in (USER, OTHER):
+        ids = [t.id for t in data[name]['transactions']]
+        assert len(ids) == WRITERS * WRITES // 2
+        assert len(set(ids)) == len(ids)
+    # An even number of toggles, each of which must have seen the one before
+    assert data[USER]['dark_mode'] is False
+
+def test_sharded_restore_switches_every_user_at_once(tmp_path):
+    root = str(tmp_path / 'data')
+    names = [f'User {i}' for i in range(8)]
+    def backup(generation: int) -> dict:
+        return {
+            name: {'password': None, 'dark_mode': False, 'transactions': [
+                {'type': 'debt', 'date': '2025-01-01', 'amount': '1.00',
+                 'desc': f'Generation {generation}'}
+            ]}
+            for name in names
+        }
+    storage = get_storage('sharded', root)
+    storage.save(backup(0))
+    # Other workers read everything and write while restores run
+    reader, writer = get_storage('sharded', root), get_storage('sharded', root)
+    stop = threading.Event()
+    generations = []
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                generations.append({
+                    txn.desc for user in reader.read().values() for txn in user['transactions']
+                    if txn.desc.startswith('Generation')
+                })
+            except Exception as e:
+                errors.append(e)
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            try:
+                writer.apply({'op': 'add_txn', 'name': names[i % len(names)], 'txn': txn(i)})
+            except Exception as e:
+                errors.append(e)
+            i += 1
+
+    threads = [threading.Thread(target=read), threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for generation in range(1, 21):
+        storage.save(backup(generation))
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert generations and all(len(seen) == 1 for seen in generations)
+    assert {txn.desc for user in storage.read().values() for txn in user['transactions']
+            if txn.desc.startswith('Generation')} == {'Generation 20'}
+    # Only the current shards are left. A reader that raced a restore may
+    # have recreated an old shard's lock, so those aren't counted.
+    shards = {entry['shard'] for entry in storage.users().values()}
+    left = {f.split('.')[0] for f in os.listdir(os.path.join(root, 'shards'))
+            if not f.endswith('.lock')}
+    assert left == shards
+
+def test_sharded_restore_removes_old_shards_and_keeps_their_history(tmp_path):
+    root = str(tmp_path / 'data')
+    storage = get_storage('sharded', root)
+    storage.save({USER: {'password': None, 'dark_mode': False, 'transactions': []}})
+    added = txn(0)
+    storage.apply({'op': 'add_txn', 'name': USER, 'txn': added})
+    storage.save({OTHER: {'password': None, 'dark_mode': False, 'transactions': []}})
+    shard = storage.users()[OTHER]['shard']
+    assert sorted(os.listdir(os.path.join(root, 'shards'))) == [
+        f'{shard}.json', f'{shard}.json.lock', f'{shard}.json.version']
+    with open(storage.audit_file) as f:
+        assert added['id'] in f.read()
+
+def test_a_write_never_changes_data_another_thread_holds(engine, tmp_path):
+    # Views on other threads may still be rendering what they loaded
+    storage = open_storage(engine, str(tmp_path / DATA_FILES[engine]))
+    storage.initialise({USER: {'password': None, 'dark_mode': False, 'transactions': []}})
+    ledger = storage.load()[USER]['transactions']
+    version = ledger.version
+    writer = threading.Thread(
+        target=storage.apply, args=({'op': 'add_txn', 'name': USER, 'txn': txn(0)},))
+    writer.start()
+    writer.join()
+    assert len(ledger) == 0 and ledger.version == version
+    assert len(storage.load()[USER]['transactions']) == 1
+
+def write_legacy_json(filename: str) -> JsonStorage:
+    # A JSON store with changes still in its journal
+    legacy = JsonStorage(filename)
+    legacy.initialise({'Ethan Ryoo': {'password': None, 'dark_mode': False, 'transactions': []}})
+    legacy.apply({'op': 'add_user', 'name': USER, 'password': None})
+    legacy.apply({'op': 'add_txn', 'name': USER, 'txn': txn(0)})
+    assert os.path.getsize(legacy.journal_file) > 0
+    return legacy
+
+def test_migration_to_sqlite_keeps_journaled_changes(tmp_path):
+    write_legacy_json(str(tmp_path / 'data.json'))
+    migrate_json_to_sqlite(str(tmp_path / 'data.json'), str(tmp_path / 'data.db'))
+    data = get_storage('sqlite', str(tmp_path / 'data.db')).read()
+    assert set(data) == {'Ethan Ryoo', USER}
+    assert len(data[USER]['transactions']) == 1
+
+def test_switching_engines_keeps_journaled_changes(load_main):
+    # load_main runs in a directory of its own, where main looks for data.json
+    write_legacy_json('data.json')
+    data = load_main().storage.read()
+    assert set(data) == {'Ethan Ryoo', USER}
+    assert len(data[USER]['transactions']) == 1
+
+def test_password_hashes_stay_out_of_the_journal_and_audit(engine, tmp_path):
+    if engine == 'sqlite':
+        pytest.skip('SQLite keeps no journal or audit')
+    storage = open_storage(engine, str(tmp_path / DATA_FILES[engine]))
+    storage.initialise({USER: {'password': None, 'dark_mode': False, 'transactions': []}})
+    storage.apply({'op': 'add_txn', 'name': USER, 'txn': txn(0)})
+    storage.apply({'op': 'add_user', 'name': OTHER, 'password': 'hash-one'})
+    storage.apply({'op': 'set_password', 'name': USER, 'password': 'hash-two'})
+    storage.apply({'op': 'add_txn', 'name': USER, 'txn': txn(1)})
+    for path in tmp_path.rglob('*'):
+        if path.suffix in ('.journal', '.audit'):
+            assert b'hash-' not in path.read_bytes(), path
+    audit = [p for p in tmp_path.rglob('*.audit') if b'set_password' in p.read_bytes()]
+    assert len(audit) == 1
+    data = get_storage(engine, str(tmp_path / DATA_FILES[engine])).read()
+    assert data[OTHER]['password'] == 'hash-one'
+    assert data[USER]['password'] == 'hash-two'
+    assert len(data[USER]['transactions']) == 2